@@ -67,6 +67,156 @@ function perform_tests()
     cat $report_file
 }
 
+function generate_small_compilation_units()
+{
+    local size=$1
+
+    for i in `seq $size`; do
+        local filename="$project_sources/small_unit_${i}.cpp"
+        echo "void func_$i() {}" > $filename
+        echo $filename
+    done
+
+    local main_filename=$project_sources/main.cpp
+    echo "int main() {}" > $main_filename
+    echo $main_filename
+}
+
+function perform_many_units_tests()
+{
+    local compilation_unit_size=4000
+    local jobs=8
+
+    echo "making $compilation_unit_size small compilation units, stand by..."
+    generate_small_compilation_units $compilation_unit_size > small_units.list
+    echo
+
+    test_pake_many_units $jobs
+    test_pake_unity_build $jobs 100
+    test_spawn_overhead
+
+    cat $report_file
+}
+
+function generate_pake_modules()
+{
+    local size=$1
+    local lines=$2
+
+    for i in `seq $size`; do
+        local filename="lexer_corpus/module_${i}.pake"
+
+        for j in `seq $lines`; do
+            echo 'append $sources src/compilation_unit_'$j'.cpp "quoted ${other.variable}" # comment'
+        done > $filename
+
+        echo 'target application app_'$i' sources($sources) compiler_flags(-O2 -DVALUE=1) \' >> $filename
+        echo '    run_before("echo ${__build}")' >> $filename
+    done
+}
+
+function perform_lexer_tests()
+{
+    local modules=600
+    local lines=100
+
+    echo "making $modules pake modules, $lines lines each, stand by..."
+    mkdir -p lexer_corpus
+    generate_pake_modules $modules $lines
+    echo
+
+    echo -n "lexing $modules modules:     " | report
+    python -c "
+import sys, glob, time
+sys.path.insert(0, '`dirname $pake`')
+import pake.lexer
+files = glob.glob('lexer_corpus/*.pake')
+start = time.time()
+for filename in files:
+    pake.lexer.parse(filename)
+print('{:.3f}s'.format(time.time() - start))" | report
+
+    cat $report_file
+}
+
+function generate_startup_modules()
+{
+    local size=$1
+
+    for i in `seq $size`; do
+        echo "int main() {}" > main_$i.cpp
+        echo "target application app_$i sources(main_$i.cpp)" > module_$i.pake
+    done
+}
+
+function measure_startup()
+{
+    local name=$1
+    local runs=$2
+    shift 2
+
+    python -c "
+import subprocess, time
+start = time.time()
+for i in range($runs):
+    subprocess.check_call('$* > /dev/null', shell=True)
+print('{:<32} {:.1f}ms'.format('$name', (time.time() - start) * 1000 / $runs))" | report
+}
+
+function perform_startup_tests()
+{
+    local modules=200
+    local runs=20
+    local line="-----------------------------------------------------------------------------"
+
+    echo "making $modules pake modules, stand by..."
+    generate_startup_modules $modules
+    echo
+
+    echo $line | report
+
+    measure_startup "python itself:" $runs python -c pass
+    measure_startup "--help:" $runs $pake --help
+    measure_startup "listing targets:" $runs $pake
+
+    echo $line | report
+
+    # python 2 has no -X importtime, so imports are timed by a hook
+    echo "import times of listing targets:" | report
+    python -c "
+import sys, time, __builtin__
+sys.path.insert(0, '`dirname $pake`')
+sys.argv = ['$pake']
+original_import = __builtin__.__import__
+depth = [0]
+times = []
+def timed_import(name, *args, **kwargs):
+    fresh = name not in sys.modules
+    depth[0] += 1
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        depth[0] -= 1
+        if fresh and name in sys.modules:
+            times.append((depth[0], name, time.time() - start))
+__builtin__.__import__ = timed_import
+start = time.time()
+try:
+    execfile('$pake', {'__name__': '__main__'})
+except SystemExit:
+    pass
+sys.stdout.flush()
+for level, name, duration in times:
+    sys.stderr.write('{:>8.1f}ms | {}{}\\n'.format(duration * 1000, '  ' * level, name))
+sys.stderr.write('{:>8.1f}ms | total\\n'.format((time.time() - start) * 1000))" 2>&1 > /dev/null | report
+
+    echo $line | report
+    echo | report
+
+    cat $report_file
+}
+
 function report()
 {
     tee --append $report_file
@@ -79,6 +229,13 @@ function measure_time()
     echo "`cat time.out` $@" | tee --append $report_file
 }
 
+function measure_time_and_memory()
+{
+    /usr/bin/time --format "%E %MKB" --output=time.out $@
+
+    echo "`cat time.out` $@" | tee --append $report_file
+}
+
 function test_buildsystem()
 {
     local build_command=$@
@@ -108,8 +265,103 @@ function test_pake()
     done
 
     echo "target application build_by_pake sources(\$sources) include_dirs(.)" >> $pake_module
+    echo "configuration depfile dependency_scan(depfile)" >> $pake_module
 
+    echo "pake, separate dependency scan" | report
     PYTHONDONTWRITEBYTECODE=1 test_buildsystem $pake -a -j1
+
+    echo "pake, dependencies from depfile" | report
+    PYTHONDONTWRITEBYTECODE=1 test_buildsystem $pake -a -j1 -c depfile
+}
+
+function test_pake_many_units()
+{
+    local jobs=$1
+    local pake_module=many_units.pake
+    local line="-----------------------------------------------------------------------------"
+
+    echo -n > $pake_module
+
+    cat small_units.list | while read unit; do
+        echo "append \$sources $unit" >> $pake_module
+    done
+
+    echo "target application many_units_by_pake sources(\$sources)" >> $pake_module
+
+    echo $line | report
+
+    echo -n "many units, clean build:         " | report
+    PYTHONDONTWRITEBYTECODE=1 measure_time_and_memory $pake -j$jobs many_units_by_pake
+
+    echo -n "many units, nothing to be done:  " | report
+    PYTHONDONTWRITEBYTECODE=1 measure_time_and_memory $pake -j$jobs many_units_by_pake
+
+    echo $line | report
+    echo | report
+}
+
+function test_pake_unity_build()
+{
+    local jobs=$1
+    local batch_size=$2
+    local pake_module=unity_build.pake
+    local changed_unit=`sed -n 2p small_units.list`
+    local line="-----------------------------------------------------------------------------"
+
+    echo -n > $pake_module
+
+    cat small_units.list | while read unit; do
+        echo "append \$sources $unit" >> $pake_module
+    done
+
+    echo "target application one_by_one sources(\$sources)" >> $pake_module
+    echo "target application in_batches sources(\$sources) unity_build($batch_size)" >> $pake_module
+
+    echo $line | report
+
+    for target in one_by_one in_batches; do
+        echo -n "$target, clean build:         " | report
+        PYTHONDONTWRITEBYTECODE=1 measure_time $pake -j$jobs $target
+
+        echo -n "$target, nothing to be done:  " | report
+        PYTHONDONTWRITEBYTECODE=1 measure_time $pake -j$jobs $target
+
+        # second time, the file is already out of its batch
+        for i in 1 2; do
+            sleep 1
+            echo "void changed_${target}_$i() {}" >> $changed_unit
+            echo -n "$target, one file changed:    " | report
+            PYTHONDONTWRITEBYTECODE=1 measure_time $pake -j$jobs $target
+        done
+    done
+
+    echo $line | report
+    echo | report
+}
+
+function test_spawn_overhead()
+{
+    local processes=1000
+    local unit=`head -n 1 small_units.list`
+    local line="-----------------------------------------------------------------------------"
+
+    echo $line | report
+
+    # pake used to run every compiler through /bin/sh
+    python -c "
+import subprocess, time
+def measure(name, command, shell):
+    start = time.time()
+    for i in range($processes):
+        subprocess.check_call(command, shell=shell)
+    print('{:<32} {:.3f}ms per process'.format(name, (time.time() - start) * 1000 / $processes))
+measure('spawn through shell:', 'true', True)
+measure('spawn directly:', ['true'], False)
+measure('compile through shell:', 'c++ -c -o /dev/null $unit', True)
+measure('compile directly:', ['c++', '-c', '-o', '/dev/null', '$unit'], False)" | report
+
+    echo $line | report
+    echo | report
 }
 
 function test_cmake()
@@ -139,6 +391,21 @@ function main()
     pushd $working_directory
     perform_tests
     popd
+
+    mkdir -p $working_directory/many_units/$project_sources
+    pushd $working_directory/many_units
+    perform_many_units_tests
+    popd
+
+    mkdir -p $working_directory/lexer
+    pushd $working_directory/lexer
+    perform_lexer_tests
+    popd
+
+    mkdir -p $working_directory/startup
+    pushd $working_directory/startup
+    perform_startup_tests
+    popd
 }
 
 main
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import errno
+import socket
+import struct
+
+import ui
+
+# every message from the server is a channel, length and data
+_HEADER = struct.Struct("!cI")
+
+STDOUT = "o"
+STDERR = "e"
+EXIT = "x"
+
+
+def socket_filename():
+    return os.path.join(os.getcwd(), "__build", "pake.socket")
+
+
+def send_message(connection, channel, data):
+    connection.sendall(_HEADER.pack(channel, len(data)) + data)
+
+
+def _receive_exactly(connection, size):
+    chunks = []
+    while size > 0:
+        chunk = connection.recv(size)
+        if not chunk:
+            raise EOFError("server closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+
+def _connect():
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_filename())
+        return connection
+    except socket.error as e:
+        connection.close()
+        if e.errno not in [errno.ENOENT, errno.ECONNREFUSED]:
+            raise
+        return None
+
+
+def should_forward(args):
+    """ server can't watch and it can't serve itself, args are parsed,
+        so combined flags (like -aw) are recognized as well """
+    return not (args.server or args.watch)
+
+
+def forward(argv):
+    """ lets pake server, if there is one, do the work, output is
+        streamed back, returns exit code or None if there is no server """
+    if not os.path.exists(socket_filename()):
+        return None
+
+    connection = _connect()
+
+    if connection is None:
+        return None
+
+    streams = {STDOUT: sys.stdout, STDERR: sys.stderr}
+
+    try:
+        # environment and arguments can be anything, latin-1 keeps bytes as they are
+        connection.sendall(json.dumps({"argv": argv,
+                                       "cwd": os.getcwd(),
+                                       "env": dict(os.environ)},
+                                      encoding="latin-1") + "\n")
+
+        while True:
+            channel, size = _HEADER.unpack(_receive_exactly(connection, _HEADER.size))
+            data = _receive_exactly(connection, size)
+
+            if channel == EXIT:
+                return int(data)
+
+            streams[channel].write(data)
+            streams[channel].flush()
+    except EOFError:
+        sys.stderr.write("pake server went away\n")
+        return 1
+    except KeyboardInterrupt:
+        # closed connection tells the server to stop building
+        ui.fatal("interrupted")
+    finally:
+        connection.close()
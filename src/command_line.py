@@ -1,17 +1,24 @@
+import os
 import argparse
 
 import ui
 
 
-def _parse_command_line():
+def parse(argv):
     parser = argparse.ArgumentParser(description='Painless buildsystem.')
     parser.add_argument('target', metavar='target', nargs="*", help='targets to be built')
     parser.add_argument('-a', '--all',  action="store_true", help='build all targets')
     parser.add_argument('-c', action='store', dest='configuration', default="__default", nargs="?", help='configuration to be used')
     parser.add_argument('-j', action='store', dest='jobs', default="1", nargs="?", help='parallel jobs to be used')
     parser.add_argument('-v', '--verbose',  action="store_true", help='show tool invokations')
-    args = parser.parse_args()
+    parser.add_argument('-w', '--watch',  action="store_true", help='build again whenever something changes')
+    parser.add_argument('--trace', action='store', dest='trace', help='write Chrome trace of the build to the file and show its summary')
+    parser.add_argument('--server',  action="store_true", help='keep everything in memory and do the work for other pake invocations')
+    parser.add_argument('--object-cache', action='store', dest='object_cache', default=os.environ.get("PAKE_OBJECT_CACHE"), help='directory of the object cache shared between builds (PAKE_OBJECT_CACHE)')
+    parser.add_argument('--object-cache-size', action='store', dest='object_cache_size', type=int, default=os.environ.get("PAKE_OBJECT_CACHE_SIZE", 5120), help='object cache size limit in megabytes (PAKE_OBJECT_CACHE_SIZE)')
+    args = parser.parse_args(argv)
     ui.debug(str(args))
     return args
 
-args = _parse_command_line()
+# set by pake.main, so importing this module doesn't parse anything
+args = None
@@ -1,136 +1,354 @@
 import os
-import marshal
+import re
+import shlex
 
 import ui
 import fsutils
 import shell
+import tracing
 import configurations
 import command_line
 
 
+def _parse_makefile_rule(rule):
+    """ returns prerequisites from the rule made by -M or -MD """
+    rule = rule.replace("\\\n", " ")
+    _, _, prerequisites = rule.partition(": ")
+    return [prerequisite.replace("\\ ", " ")
+            for prerequisite in re.split(r"(?<!\\)\s+", prerequisites)
+            if prerequisite]
+
+
+def _split(value):
+    """ flags written by the user might be quoted like for the shell """
+    return shlex.split(value)
+
+
+def _compiler():
+    return _split(configurations.compiler())
+
+
+def _has_debug_info(flags):
+    """ the last of -g, -ggdb, -g3, -g0 and alike wins """
+    debug_flags = [flag for flag in flags if flag.startswith("-g")]
+    return bool(debug_flags) and debug_flags[-1] != "-g0"
+
+
 class Gnu:
+    def __init__(self, database, object_cache=None):
+        self.database = database
+        self.object_cache = object_cache
+
     def build_object(self, target_name, out_filename, in_filename, include_dirs,
-                     compiler_flags):
+                     compiler_flags, cwd, precompiled_header=None):
+        flags = self.__prepare_compiler_flags(include_dirs, compiler_flags)
+
+        prerequisites = []
+
+        if precompiled_header is not None:
+            # compiler takes precompiled_header + ".gch" instead, if it can,
+            # but then the depfile doesn't mention the header
+            flags += ["-include", precompiled_header]
+            prerequisites.append(precompiled_header + ".gch")
+
+        self.__build(out_filename, in_filename, flags, [], prerequisites, cwd, cacheable=True)
 
-        abs_source = os.path.join(os.getcwd(), in_filename)
+    def build_precompiled_header(self, target_name, out_filename, in_filename,
+                                 include_dirs, compiler_flags, cwd):
+        """ out_filename is the header to be included by objects, it only
+            includes in_filename, precompiled one is made next to it """
+        fsutils.write_if_changed(out_filename,
+                                 '#include "{}"\n'.format(os.path.join(cwd, in_filename)))
+
+        flags = self.__prepare_compiler_flags(include_dirs, compiler_flags)
+        self.__build(out_filename + ".gch", in_filename, flags, ["-x", "c++-header"], [], cwd,
+                     cacheable=False)
+
+    def __build(self, out_filename, in_filename, flags, language_flags, prerequisites, cwd,
+                cacheable):
+        """ prerequisites are files which compiler won't tell about """
+        abs_source = os.path.join(cwd, in_filename)
 
         ui.debug("building object " + out_filename)
 
         with ui.ident:
-            prerequisites = self.__fetch_includes(target_name, abs_source,
-                                                  include_dirs, compiler_flags)
-            prerequisites.append(in_filename)
+            use_depfile = configurations.dependency_scan() == "depfile"
+
+            if use_depfile:
+                includes = self.__known_includes(out_filename)
+            else:
+                includes = self.__fetch_includes(out_filename, abs_source, flags, cwd)
+
+            depfile = self.__depfile_filename(out_filename) if use_depfile else None
 
-            ui.debug("appending prerequisites from pake modules: {!s}"
-                     .format(fsutils.pake_files))
+            cmd = _compiler() + flags + language_flags + ["-c", "-o", out_filename, abs_source]
+            if use_depfile:
+                cmd += ["-MD", "-MF", depfile]
+
+            if includes is None:
+                ui.debug("includes are not known yet, {} needs to be built"
+                         .format(out_filename))
+                needs_building = True
+            else:
+                includes = includes + prerequisites
+                ui.debug("prerequisites: {!r}".format(includes))
 
-            prerequisites.extend(fsutils.pake_files)
+                # sources including the same headers share this set
+                needs_building = fsutils.is_newer_than(abs_source, out_filename) or \
+                                 fsutils.is_any_newer_than(includes, out_filename) or \
+                                 self.__is_command_changed(out_filename, cmd)
 
-            ui.debug("prerequisites: {!r}".format(prerequisites))
+            if needs_building and includes is not None and \
+                    self.__is_content_unchanged(out_filename, [abs_source] + includes, cmd):
+                ui.debug("content of {} prerequisites didn't change".format(out_filename))
+                needs_building = False
 
-            if fsutils.is_any_newer_than(prerequisites, out_filename):
+            if needs_building:
                 fsutils.mkdir_recursive(os.path.dirname(out_filename));
 
-                cmd = configurations.compiler() + " " + self.__prepare_compiler_flags(include_dirs, compiler_flags) + " -c -o " + out_filename + " " + abs_source
-                if command_line.args.verbose:
-                    ui.step(configurations.compiler(), cmd)
+                cache_key = None
+                if cacheable:
+                    cache_key = self.__object_cache_key(flags, abs_source, depfile, cwd)
+
+                if cache_key is not None and self.object_cache.fetch(cache_key, out_filename):
+                    ui.step("cached", in_filename)
                 else:
-                    ui.step(configurations.compiler(), in_filename)
+                    self.__compile(cmd, in_filename, out_filename, cache_key, cwd)
+
+                if use_depfile:
+                    includes = (self.__update_includes_from_depfile(out_filename, depfile, cwd) +
+                                prerequisites)
 
-                shell.execute(cmd)
+                self.database.update(out_filename, command=cmd)
+                self.__remember_content(out_filename, [abs_source] + includes, cmd)
+
+    def __compile(self, cmd, in_filename, out_filename, cache_key, cwd):
+        if command_line.args.verbose:
+            ui.step(configurations.compiler(), shell.format_command(cmd))
+        else:
+            ui.step(configurations.compiler(), in_filename)
 
-    def link_application(self, out_filename, in_filenames, link_with, library_dirs):
-        if fsutils.is_any_newer_than(in_filenames, out_filename) or self.__are_libs_newer_than_target(link_with, out_filename):
+        if self.object_cache is not None:
+            self.object_cache.detach(out_filename)
+
+        with tracing.span(in_filename, "compile"):
+            shell.execute(cmd, cwd=cwd)
+        fsutils.invalidate(out_filename)
+
+        if cache_key is not None:
+            self.object_cache.store(cache_key, out_filename)
+
+    def __object_cache_key(self, flags, abs_source, depfile, cwd):
+        if self.object_cache is None:
+            return None
+
+        # depfile is made here as well, there will be no compilation if it's a hit
+        cmd = _compiler() + flags + ["-E", abs_source]
+        if not _has_debug_info(flags):
+            # line markers hold absolute paths, without them checkouts can
+            # share objects, but debug info needs the lines to be right
+            cmd.append("-P")
+        if depfile is not None:
+            cmd += ["-MD", "-MF", depfile]
+
+        try:
+            preprocessed_source = shell.execute(cmd, capture_output=True, cwd=cwd)
+        except Exception as e:
+            ui.debug("can't preprocess {}, not using object cache: {!s}".format(abs_source, e))
+            return None
+
+        return self.object_cache.key(configurations.compiler(), flags,
+                                     preprocessed_source, cwd)
+
+    def link_application(self, out_filename, in_filenames, link_with, library_dirs, cwd):
+        parameters = [parameter for lib_dir in library_dirs for parameter in ["-L", lib_dir]]
+        cmd = (_compiler() +
+               _split(configurations.linker_flags()) +
+               ["-o", out_filename] +
+               in_filenames +
+               self.__prepare_linker_flags(link_with) +
+               parameters)
+        prerequisites = in_filenames + self.__libraries_from_tree(link_with)
+
+        if (fsutils.is_any_newer_than(in_filenames, out_filename) or self.__are_libs_newer_than_target(link_with, out_filename)
+                or self.__is_command_changed(out_filename, cmd)) \
+                and not self.__is_content_unchanged(out_filename, prerequisites, cmd):
             ui.debug("linking application")
             ui.debug("  files: " + str(in_filenames))
             ui.debug("  with libs: " + str(link_with))
             ui.debug("  lib dirs: " + str(library_dirs))
 
-            parameters = " ".join("-L " + lib_dir for lib_dir in library_dirs)
-
             ui.bigstep("linking", out_filename)
             try:
-                shell.execute(" ".join([configurations.compiler(),
-                                        configurations.linker_flags(),
-                                        "-o", out_filename,
-                                        " ".join(in_filenames),
-                                        self.__prepare_linker_flags(link_with),
-                                        parameters]))
+                with tracing.span(out_filename, "link"):
+                    shell.execute(cmd, cwd=cwd)
+                fsutils.invalidate(out_filename)
+                self.database.update(out_filename, command=cmd)
+                self.__remember_content(out_filename, prerequisites, cmd)
             except Exception as e:
                 ui.fatal("cannot link {}, reason: {!s}".format(out_filename, e))
         else:
             ui.bigstep("up to date", out_filename)
 
-    def link_static_library(self, out_filename, in_filenames):
+    def link_static_library(self, out_filename, in_filenames, cwd):
+        cmd = _split(configurations.archiver()) + ["-rcs", out_filename] + in_filenames
+
+        if not (fsutils.is_any_newer_than(in_filenames, out_filename)
+                or self.__is_command_changed(out_filename, cmd)) \
+                or self.__is_content_unchanged(out_filename, in_filenames, cmd):
+            ui.bigstep("up to date", out_filename)
+            return
+
         ui.bigstep(configurations.archiver(), out_filename)
-        shell.execute(configurations.archiver() + " -rcs " + out_filename + " " + " ".join(in_filenames))
+        with tracing.span(out_filename, "link"):
+            shell.execute(cmd, cwd=cwd)
+        fsutils.invalidate(out_filename)
+        self.database.update(out_filename, command=cmd)
+        self.__remember_content(out_filename, in_filenames, cmd)
 
     def object_filename(self, target_name, source_filename):
         return configurations.build_dir() + "/build." + target_name + "/" + source_filename + ".o"
 
+    def precompiled_header_filename(self, target_name, header_filename):
+        return configurations.build_dir() + "/build." + target_name + "/" + header_filename
+
+    def unity_source_filename(self, target_name, index):
+        return configurations.build_dir() + "/build." + target_name + "/unity_{}.cpp".format(index)
+
     def static_library_filename(self, target_name):
         return configurations.build_dir() + "/lib" + target_name + ".a"
 
     def application_filename(self, target_name):
         return configurations.build_dir() + "/" + target_name + configurations.application_suffix()
 
-    def cache_directory(self, target_name):
-        return configurations.build_dir() + "/build." + target_name + "/"
-
     def build_dir(self):
         return configurations.build_dir()
 
-    def __fetch_includes(self, target_name, in_filename, include_dirs, compiler_flags):
+    def __fetch_includes(self, out_filename, in_filename, flags, cwd):
         ui.debug("getting includes for " + in_filename)
 
         with ui.ident:
-            cache_file = self.cache_directory(target_name) + in_filename + ".includes"
-            includes = None
-            if os.path.exists(cache_file) and fsutils.is_newer_than(cache_file, in_filename):
-                includes = marshal.load(open(cache_file, "rb"))
-            else:
-                fsutils.mkdir_recursive(os.path.dirname(cache_file));
-                includes = self.__scan_includes(in_filename, include_dirs, compiler_flags)
-                marshal.dump(includes, open(cache_file, "wb"))
+            entry = self.database.get(out_filename)
 
+            # includes might change only if the source or one of
+            # the headers did
+            if entry is not None and "mtimes" in entry and \
+                    self.__are_mtimes_unchanged(entry["mtimes"]):
+                return list(entry["includes"])
+
+            includes = self.__scan_includes(in_filename, flags, cwd)
+            mtimes = dict((filename, fsutils.get_mtime_if_exists(filename))
+                          for filename in [in_filename] + includes)
+            self.database.update(out_filename, includes=includes, mtimes=mtimes)
+
+        return list(includes)
+
+    def __known_includes(self, out_filename):
+        entry = self.database.get(out_filename)
+
+        if entry is not None and "includes" in entry:
+            return list(entry["includes"])
+
+    def __depfile_filename(self, out_filename):
+        return os.path.splitext(out_filename)[0] + ".d"
+
+    def __update_includes_from_depfile(self, out_filename, depfile, cwd):
+        try:
+            with open(depfile) as f:
+                rule = f.read()
+        except IOError:
+            ui.debug("compiler didn't make {}, assuming no includes".format(depfile))
+            rule = ""
+
+        includes = self.__includes_from_makefile_rule(rule, cwd)
+        self.database.update(out_filename, includes=includes)
         return includes
 
-    def __scan_includes(self, in_filename, include_dirs, compiler_flags):
+    def __is_command_changed(self, out_filename, cmd):
+        entry = self.database.get(out_filename)
+
+        if entry is None or entry.get("command") != cmd:
+            ui.debug("command making {} changed".format(out_filename))
+            return True
+
+        return False
+
+    def __is_content_unchanged(self, out_filename, prerequisites, cmd):
+        """ in content change detection mode, tells whether out_filename was
+            made by the same command from prerequisites having the same
+            content, even if their mtimes say otherwise """
+        if configurations.change_detection() != "content":
+            return False
+
+        entry = self.database.get(out_filename)
+
+        if entry is None or "hashes" not in entry or not fsutils.is_file(out_filename):
+            return False
+
+        if entry.get("command") != cmd or set(entry["hashes"]) != set(prerequisites):
+            return False
+
+        return all(self.database.content_hash(filename) == digest
+                   for filename, digest in entry["hashes"].items())
+
+    def __remember_content(self, out_filename, prerequisites, cmd):
+        if configurations.change_detection() != "content":
+            return
+
+        hashes = dict((filename, self.database.content_hash(filename))
+                      for filename in prerequisites)
+        self.database.update(out_filename, command=cmd, hashes=hashes)
+
+    def __are_mtimes_unchanged(self, mtimes):
+        for filename, mtime in mtimes.items():
+            if fsutils.get_mtime_if_exists(filename) != mtime:
+                ui.debug("{} changed since last scan".format(filename))
+                return False
+        return True
+
+    def __scan_includes(self, in_filename, flags, cwd):
         ui.debug("scanning includes for " + in_filename)
         try:
-            flags = self.__prepare_compiler_flags(include_dirs, compiler_flags)
-            out = shell.execute(" ".join([configurations.compiler(), flags, "-M",
-                                          in_filename]),
-                                capture_output=True).split()
+            with tracing.span(in_filename, "include scan"):
+                out = shell.execute(_compiler() + flags + ["-M", in_filename],
+                                    capture_output=True, cwd=cwd)
         except Exception as e:
             raise Exception("error while building dependency graph for"
                             "{!s}, {!s}".format(in_filename, e))
 
+        return self.__includes_from_makefile_rule(out, cwd)
+
+    def __includes_from_makefile_rule(self, rule, cwd):
         def is_system_include(filename):
             return filename.startswith("/usr/include") or filename.startswith("/usr/lib")
 
-        return [token for token in out[2:] if not token == "\\" and not is_system_include(token)]
+        # first one is the source itself
+        return [os.path.join(cwd, filename) for filename in _parse_makefile_rule(rule)[1:]
+                if not is_system_include(filename)]
 
     def __prepare_linker_flags(self, link_with):
-        libs_str = "".join(" -l" + lib for lib in link_with)
-        return " ".join(["-L " + configurations.build_dir(), libs_str])
+        return ["-L", configurations.build_dir()] + ["-l" + lib for lib in link_with]
 
     def __prepare_compiler_flags(self, include_dirs, compiler_flags):
-        return " ".join([configurations.compiler_flags(),
-                         " ".join(compiler_flags),
-                         self.__prepare_include_dirs_parameters(include_dirs)])
+        return (_split(configurations.compiler_flags()) +
+                [flag for flags in compiler_flags for flag in _split(flags)] +
+                self.__prepare_include_dirs_parameters(include_dirs))
 
     def __prepare_include_dirs_parameters(self, include_dirs):
-        ret = " ".join("-I" + include_dir for include_dir in include_dirs)
-        ui.debug("include parameters: " + ret)
+        ret = ["-I" + include_dir for include_dir in include_dirs]
+        ui.debug("include parameters: " + str(ret))
         return ret
 
+    def __libraries_from_tree(self, link_with):
+        files = (self.static_library_filename(lib) for lib in link_with)
+        return [filename for filename in files if fsutils.is_file(filename)]
+
     def __are_libs_newer_than_target(self, link_with, target):
         # check if the library is from our source tree
         files = (self.static_library_filename(lib) for lib in link_with)
 
         def is_newer_than_target(filename):
-            if os.path.exists(filename):
+            if fsutils.is_file(filename):
                 # TODO: proper appname
                 return fsutils.is_newer_than(filename, target)
 
@@ -27,6 +27,25 @@ def archiver():
 def application_suffix():
     return get_selected_configuration().application_suffix.eval_to_string()
 
+def _choice(parameter, value, choices):
+    if value not in choices:
+        ui.fatal("unknown {}: {}, perhaps try one of these: {}"
+                 .format(parameter, value, ", ".join(choices)))
+    return value
+
+def dependency_scan():
+    return _choice("dependency_scan",
+                   get_selected_configuration().dependency_scan.eval_to_string(),
+                   ["separate", "depfile"])
+
+def change_detection():
+    return _choice("change_detection",
+                   get_selected_configuration().change_detection.eval_to_string(),
+                   ["mtime", "content"])
+
+def unity_build():
+    return get_selected_configuration().unity_build.eval_to_string()
+
 def get_selected_configuration():
     try:
         return configurations[command_line.args.configuration]
@@ -42,6 +61,12 @@ def _create_default_configuration():
     configuration = Configuration()
     add_configuration(configuration)
 
+def reset():
+    """ leaves only the default configuration, has to be called
+        before anything is parsed """
+    configurations.clear()
+    _create_default_configuration()
+
 class Configuration:
     def __init__(self):
         self.name = "__default"
@@ -50,9 +75,10 @@ class Configuration:
         self.linker_flags = variables.make_simple_variable("-L.")
         self.application_suffix = variables.make_simple_variable("")
         self.archiver = variables.make_simple_variable("ar")
+        self.dependency_scan = variables.make_simple_variable("separate")
+        self.change_detection = variables.make_simple_variable("mtime")
+        self.unity_build = variables.make_simple_variable("0")
         self.export = []
 
     def __repr__(self):
         return self.name
-
-_create_default_configuration()
@@ -0,0 +1,103 @@
+import os
+import time
+import marshal
+import threading
+
+import ui
+import fsutils
+
+_FORMAT_VERSION = 2
+
+# long builds are written down from time to time, so killed pake
+# doesn't forget everything it has done
+_SAVE_INTERVAL = 30
+
+
+def filename(configuration_name):
+    return os.path.join(fsutils.build_dir(configuration_name), "pake.db")
+
+
+class Database:
+    """ everything pake needs to remember between the runs (e.g. include
+        dependencies of the sources), it's read at once when build starts
+        and written back when it ends (and every now and then) """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__file_hashes = {}
+        self.__dirty = False
+        self.__saved = time.time()
+
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                data = marshal.loads(f.read())
+        except (IOError, EOFError, ValueError, TypeError):
+            ui.debug("no usable database in {}".format(self.filename))
+            return
+
+        if data[0] == _FORMAT_VERSION:
+            _, self.__entries, self.__file_hashes = data
+        else:
+            ui.debug("database {} has unknown version {!s}, dropping it"
+                     .format(self.filename, data[0]))
+
+    def get(self, key):
+        with self.__lock:
+            return self.__entries.get(key)
+
+    def update(self, key, **values):
+        with self.__lock:
+            self.__entries.setdefault(key, {}).update(values)
+            self.__dirty = True
+
+            if time.time() - self.__saved > _SAVE_INTERVAL:
+                self.__save()
+
+    def content_hash(self, filename):
+        """ file is read again only when its mtime or size changes,
+            returns None if it doesn't exist """
+        st = fsutils.stat_cache.get_stat(filename)
+
+        if st is None:
+            return None
+
+        with self.__lock:
+            known = self.__file_hashes.get(filename)
+
+        if known is not None and known[0] == st:
+            return known[1]
+
+        ui.debug("hashing " + filename)
+        digest = fsutils.hash_file(filename)
+
+        with self.__lock:
+            self.__file_hashes[filename] = (st, digest)
+            self.__dirty = True
+
+        return digest
+
+    def save(self):
+        with self.__lock:
+            if self.__dirty:
+                self.__save()
+
+    def __save(self):
+        """ lock has to be held """
+        ui.debug("saving database to {}".format(self.filename))
+
+        fsutils.mkdir_recursive(os.path.dirname(self.filename))
+
+        # rename is atomic, so interrupted pake never leaves broken file
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "wb") as f:
+            f.write(marshal.dumps((_FORMAT_VERSION, self.__entries,
+                                   self.__file_hashes)))
+        os.rename(temporary_filename, self.filename)
+
+        self.__dirty = False
+        self.__saved = time.time()
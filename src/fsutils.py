@@ -1,10 +1,18 @@
 import os
+import re
+import stat
+import time
 import errno
+import marshal
+import fnmatch
+import hashlib
 import itertools
-import time
+import threading
+import collections
 
 import ui
 import shell
+import tracing
 
 BUILD_ROOT = os.path.normpath(os.getcwd() + "/__build")
 
@@ -24,9 +32,92 @@ def build_dir(configuration_name):
     return os.path.normpath(BUILD_ROOT + "/" + configuration_name)
 
 
+class StatCache:
+    """ remembers stats of the files for the whole run, files which pake
+        writes by itself have to be invalidated explicitly """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__stats = {}
+        self.__newest_mtimes = {}
+
+        # sets of files in __newest_mtimes, by every file they have
+        self.__sets_with = collections.defaultdict(set)
+
+    def get_stat(self, filename):
+        """ returns (mtime, size) or None if filename is not a regular file """
+        with self.__lock:
+            if filename in self.__stats:
+                self.hits += 1
+                return self.__stats[filename]
+
+        try:
+            st = os.stat(filename)
+            ret = (st.st_mtime, st.st_size) if stat.S_ISREG(st.st_mode) else None
+        except OSError:
+            ret = None
+
+        with self.__lock:
+            self.misses += 1
+            self.__stats[filename] = ret
+
+        return ret
+
+    def get_mtime(self, filename):
+        """ returns None if filename is not a regular file """
+        st = self.get_stat(filename)
+        return st[0] if st is not None else None
+
+    def get_newest_mtime(self, filenames):
+        """ returns None if any of filenames is not a regular file,
+            result is remembered for this particular set of files """
+        key = frozenset(filenames)
+
+        with self.__lock:
+            if key in self.__newest_mtimes:
+                return self.__newest_mtimes[key]
+
+        newest = 0
+        for filename in key:
+            mtime = self.get_mtime(filename)
+            if mtime is None:
+                newest = None
+                break
+            newest = max(newest, mtime)
+
+        with self.__lock:
+            self.__newest_mtimes[key] = newest
+            for filename in key:
+                self.__sets_with[filename].add(key)
+
+        return newest
+
+    def invalidate(self, filename):
+        """ only sets having filename are forgotten, others are still valid """
+        with self.__lock:
+            self.__stats.pop(filename, None)
+            for key in self.__sets_with.pop(filename, ()):
+                self.__newest_mtimes.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__stats.clear()
+            self.__newest_mtimes.clear()
+            self.__sets_with.clear()
+
+
+stat_cache = StatCache()
+
+
 def is_newer_than(prerequisite, target):
-    if os.path.isfile(target) and os.path.isfile(prerequisite):
-        ret = get_mtime(prerequisite) > get_mtime(target)
+    target_mtime = stat_cache.get_mtime(target)
+    prerequisite_mtime = stat_cache.get_mtime(prerequisite)
+
+    if target_mtime is not None and prerequisite_mtime is not None:
+        ret = prerequisite_mtime > target_mtime
         ui.debug("is {} newer than {} = {!s}".format(prerequisite, target, ret))
         return ret
     else:
@@ -35,11 +126,57 @@ def is_newer_than(prerequisite, target):
 
 
 def is_any_newer_than(prerequisites, target):
-    return any(map(lambda pre: is_newer_than(pre, target), prerequisites))
+    if not prerequisites:
+        return False
 
+    target_mtime = stat_cache.get_mtime(target)
+    newest_mtime = stat_cache.get_newest_mtime(prerequisites)
 
-def get_mtime(filename):
-    return os.path.getmtime(filename)
+    if target_mtime is not None and newest_mtime is not None:
+        ret = newest_mtime > target_mtime
+        ui.debug("is any of {} prerequisites newer than {} = {!s}"
+                 .format(len(prerequisites), target, ret))
+        return ret
+    else:
+        ui.debug("{} or some of its prerequisites don't exist, treating like older"
+                 .format(target))
+        return True
+
+
+def get_mtime_if_exists(filename):
+    return stat_cache.get_mtime(filename)
+
+
+def hash_file(filename):
+    h = hashlib.md5()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_file(filename):
+    return stat_cache.get_mtime(filename) is not None
+
+
+def invalidate(filename):
+    """ should be called after pake writes the file """
+    stat_cache.invalidate(filename)
+
+
+def write_if_changed(filename, content):
+    """ so things depending on it are not rebuilt needlessly """
+    try:
+        with open(filename) as f:
+            if f.read() == content:
+                return
+    except IOError:
+        pass
+
+    mkdir_recursive(os.path.dirname(filename))
+    with open(filename, "w") as f:
+        f.write(content)
+    invalidate(filename)
 
 
 def flatten_list(func):
@@ -53,31 +190,193 @@ def __is_pake_file(filename):
     return extension == ".pake"
 
 
-def __pake_files_only(dirpath, filenames):
-    return (os.path.join(dirpath, filename) for filename in filenames
-            if __is_pake_file(filename)
-            and not dirpath.startswith(BUILD_ROOT))
+# there is nothing interesting in there
+_IGNORED_DIRECTORIES = [".git", ".hg", ".svn"]
+
+_DISCOVERY_CACHE_VERSION = 1
+
+# directories modified that recently might still be changing
+# within their mtime granularity, so they are not cached
+_RACY_PERIOD = 1
+
+
+def _discovery_cache_filename():
+    return os.path.join(BUILD_ROOT, "pake_files.cache")
+
+
+def _read_ignore_patterns(path):
+    """ .pakeignore has a shell pattern in each line, patterns with
+        a slash match paths relative to the project root, others
+        match names in any directory """
+    patterns = list(_IGNORED_DIRECTORIES)
+
+    try:
+        with open(os.path.join(path, ".pakeignore")) as f:
+            for line in f:
+                line = line.strip().rstrip("/")
+                if line and not line.startswith("#"):
+                    patterns.append(line)
+    except IOError:
+        pass
+
+    return patterns
+
+
+def _compile_ignore_patterns(patterns):
+    """ returns regexes matching ignored names and relative paths """
+    def any_of(patterns):
+        if patterns:
+            return re.compile("|".join("(?:{})".format(fnmatch.translate(pattern))
+                                       for pattern in patterns))
+
+    return (any_of([pattern for pattern in patterns if "/" not in pattern]),
+            any_of([pattern.lstrip("/") for pattern in patterns if "/" in pattern]))
+
+
+def _list_directory(directory, relative_directory, ignored):
+    """ returns names of modules and subdirectories worth looking into """
+    files = []
+    subdirectories = []
+    ignored_names, ignored_paths = ignored
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+
+        if path == BUILD_ROOT:
+            continue
+
+        if ignored_names and ignored_names.match(name):
+            continue
+
+        if ignored_paths and ignored_paths.match(relative_directory + name):
+            continue
+
+        if __is_pake_file(name):
+            files.append(name)
+            continue
+
+        try:
+            # like os.walk, symlinks to directories are not followed
+            if stat.S_ISDIR(os.lstat(path).st_mode):
+                subdirectories.append(name)
+        except OSError:
+            pass
+
+    return sorted(files), sorted(subdirectories)
+
+
+def _load_discovery_cache(patterns):
+    """ listings of directories found last time, by their paths """
+    try:
+        with open(_discovery_cache_filename(), "rb") as f:
+            version, cached_patterns, listings = marshal.loads(f.read())
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+
+    if version != _DISCOVERY_CACHE_VERSION or cached_patterns != patterns:
+        ui.debug("discovery cache is outdated")
+        return {}
+
+    return listings
+
+
+def _save_discovery_cache(patterns, listings):
+    filename = _discovery_cache_filename()
+    mkdir_recursive(os.path.dirname(filename))
+
+    temporary_filename = filename + ".tmp"
+    with open(temporary_filename, "wb") as f:
+        f.write(marshal.dumps((_DISCOVERY_CACHE_VERSION, patterns, listings)))
+    os.rename(temporary_filename, filename)
 
 
-@flatten_list
 def _find_pake_files(path=os.getcwd()):
-    return [__pake_files_only(dirpath, filenames)
-            for (dirpath, _, filenames) in os.walk(path)]
+    """ returns modules and directories which were searched for them """
+    files = []
+    directories = []
+
+    with tracing.span("finding pake files", "discovery"):
+        _walk_for_pake_files(path, files, directories)
+
+    return files, directories
+
+
+def _walk_for_pake_files(path, files, directories):
+    """ only directories which were modified since the last time
+        (their entries were added, removed or renamed) are listed """
+    started = time.time()
+    patterns = _read_ignore_patterns(path)
+    ignored = _compile_ignore_patterns(patterns)
+    cached_listings = _load_discovery_cache(patterns)
+    listings = {}
+    listed = 0
+
+    pending = [path]
+    while pending:
+        directory = pending.pop()
+
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            continue
+
+        listing = cached_listings.get(directory)
+        if listing is None or listing[0] != mtime:
+            relative_directory = os.path.relpath(directory, path) + "/"
+            if relative_directory == "./":
+                relative_directory = ""
+
+            listing = (mtime,) + _list_directory(directory, relative_directory, ignored)
+            listed += 1
+
+        listings[directory] = listing
+        directories.append(directory)
+        files.extend(os.path.join(directory, name) for name in listing[1])
+        pending.extend(os.path.join(directory, name) for name in reversed(listing[2]))
+
+    ui.debug("found {} pake files in {} directories, {} of them listed"
+             .format(len(files), len(directories), listed))
+
+    listings = dict((directory, listing) for directory, listing in listings.items()
+                    if listing[0] < started - _RACY_PERIOD)
+
+    if listings != cached_listings:
+        try:
+            _save_discovery_cache(patterns, listings)
+        except (IOError, OSError) as e:
+            ui.debug("can't save discovery cache: {!s}".format(e))
+
+
+def _stat_or_none(filename):
+    try:
+        st = os.stat(filename)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+
+# modules and directories searched for them, found on first use
+_pake_files = None
+_pake_directories = None
+
+
+def pake_files():
+    global _pake_files, _pake_directories
+
+    if _pake_files is None:
+        _pake_files, _pake_directories = _find_pake_files()
+
+    return _pake_files
 
-pake_files = _find_pake_files()
 
+def pake_files_state():
+    """ changes whenever some module is added, removed or modified """
+    filenames = pake_files()
+    return ([_stat_or_none(directory) for directory in _pake_directories],
+            [_stat_or_none(filename) for filename in filenames])
 
-def wait_until_something_changes():
-    mkdir_recursive(BUILD_ROOT)
-    touch_file=os.path.join(BUILD_ROOT, "ci.touch")
 
-    with open(touch_file, "w") as f:
-        f.write("don't bother about this file :)")
+def find_pake_files_again():
+    global _pake_files
 
-    while True:
-        time.sleep(1)
-        for dirpath, _, filenames in os.walk(os.getcwd()):
-            for filename in filenames:
-                if is_newer_than(os.path.join(dirpath, filename), touch_file):
-                    ui.debug("found change: {}".format(filename))
-                    return
+    _pake_files = None
@@ -0,0 +1,160 @@
+import os
+import errno
+import fcntl
+import hashlib
+import shlex
+import shutil
+import threading
+
+import ui
+import fsutils
+import shell
+
+# from linux/fs.h
+_FICLONE = 0x40049409
+
+
+def _reflink_or_copy(source, destination):
+    try:
+        with open(source, "rb") as s, open(destination, "wb") as d:
+            fcntl.ioctl(d.fileno(), _FICLONE, s.fileno())
+    except (IOError, OSError):
+        shutil.copyfile(source, destination)
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        _reflink_or_copy(source, destination)
+
+
+def _remove_if_exists(filename):
+    try:
+        os.remove(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class ObjectCache:
+    """ objects shared between configurations and checkouts, keyed by
+        preprocessed source, compiler identity and flags, hits are
+        hardlinked into the build directory, so objects in there have
+        to be removed (and never overwritten) before compiling """
+
+    def __init__(self, directory, max_size):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+        self.__lock = threading.Lock()
+        self.__compiler_identities = {}
+
+    def __compiler_identity(self, compiler, cwd):
+        with self.__lock:
+            if compiler in self.__compiler_identities:
+                return self.__compiler_identities[compiler]
+
+        identity = shell.execute(shlex.split(compiler) + ["--version"],
+                                 capture_output=True, cwd=cwd)
+
+        with self.__lock:
+            self.__compiler_identities[compiler] = identity
+
+        return identity
+
+    def key(self, compiler, flags, preprocessed_source, cwd):
+        # include dirs are already reflected in preprocessed source and
+        # they often differ between checkouts
+        flags = [flag for flag in flags if not flag.startswith("-I")]
+
+        h = hashlib.md5()
+        h.update(self.__compiler_identity(compiler, cwd))
+        h.update("\0".join(flags))
+        h.update("\0")
+        h.update(preprocessed_source)
+        return h.hexdigest()
+
+    def __filename(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + ".o")
+
+    def fetch(self, key, out_filename):
+        cached = self.__filename(key)
+
+        if not os.path.isfile(cached):
+            with self.__lock:
+                self.misses += 1
+            return False
+
+        ui.debug("object cache hit: {} for {}".format(cached, out_filename))
+
+        _remove_if_exists(out_filename)
+        _link_or_copy(cached, out_filename)
+
+        # object has to look fresh and cache entry recently used
+        os.utime(out_filename, None)
+        os.utime(cached, None)
+        fsutils.invalidate(out_filename)
+
+        with self.__lock:
+            self.hits += 1
+        return True
+
+    def detach(self, out_filename):
+        """ compiler would otherwise write into the cached object """
+        _remove_if_exists(out_filename)
+
+    def store(self, key, out_filename):
+        cached = self.__filename(key)
+        fsutils.mkdir_recursive(os.path.dirname(cached))
+
+        # rename is atomic, so other pake never sees half written object
+        temporary_filename = "{}.{}.{}.tmp".format(cached, os.getpid(),
+                                                   threading.current_thread().ident)
+        _remove_if_exists(temporary_filename)
+        _link_or_copy(out_filename, temporary_filename)
+        os.rename(temporary_filename, cached)
+
+        with self.__lock:
+            self.stored += 1
+
+    def trim(self):
+        """ removes least recently used objects until cache fits in max_size """
+        ui.debug("object cache: {} hits, {} misses, {} stored"
+                 .format(self.hits, self.misses, self.stored))
+
+        # walking whole cache is expensive, it can't grow without storing
+        if not self.stored:
+            return
+
+        entries = []
+        total_size = 0
+
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total_size += st.st_size
+
+        ui.debug("object cache: {} bytes in {} objects"
+                 .format(total_size, len(entries)))
+
+        if total_size <= self.max_size:
+            return
+
+        # leave some space, so next build doesn't trim again right away
+        limit = self.max_size * 9 / 10
+
+        for _, size, path in sorted(entries):
+            if total_size <= limit:
+                break
+            ui.debug("evicting {} from object cache".format(path))
+            _remove_if_exists(path)
+            total_size -= size
@@ -1,40 +1,146 @@
 #!/usr/bin/env python
 
+import os
+import sys
+
+import client
+import command_line
+
+if __name__ == '__main__':
+    # --help (or a typo) doesn't have to wait for the rest either
+    command_line.args = command_line.parse(sys.argv[1:])
+
+    # when pake server is running, it does the work, so there
+    # is no need to even load (and initialize) anything else
+    if client.should_forward(command_line.args):
+        exit_code = client.forward(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
 import fsutils
 import ui
+import shell
 import targets
 import variables
 import configurations
 import pake.parser
-import command_line
+import server
+import tracing
 
 
-def parse_source_tree():
-    for filename in fsutils.pake_files:
-        pake.parser.parse(filename)
+def parse_source_tree(lazy=True):
+    # when only some targets are going to be built, their modules
+    # (and modules they refer to) are enough
+    if not (lazy and command_line.args.target and
+            pake.parser.parse_needed(fsutils.pake_files(),
+                                     command_line.args.target,
+                                     command_line.args.configuration)):
+        pake.parser.parse_all(fsutils.pake_files())
 
     configuration = configurations.get_selected_configuration()
     variables.export_special_variables(configuration)
 
 
+def _watch(names):
+    targets.watch(names)
+
+    # modules changed, the easiest way to parse them again is to start over
+    ui.bigstep("restarting", "pake modules changed")
+    ui.flush()
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
 def _build_some_targets_if_requested():
-    if command_line.args.target:
-        for target in command_line.args.target:
-            targets.build(target)
+    if command_line.args.watch and (command_line.args.target or command_line.args.all):
+        _watch(command_line.args.target or targets.visible_names())
+        return True
+    elif command_line.args.target:
+        targets.build(command_line.args.target)
         return True
     elif command_line.args.all:
         targets.build_all()
         return True
 
 
+# modules and configuration which server has parsed
+_served_state = None
+
+
+def _parse_for_server():
+    global _served_state
+
+    # in case parsing is interrupted
+    _served_state = None
+
+    # modules might be added or removed as well
+    fsutils.find_pake_files_again()
+
+    targets.reset()
+    variables.reset()
+    configurations.reset()
+    pake.parser.reset()
+
+    parse_source_tree(lazy=False)
+    _served_state = (fsutils.pake_files_state(), command_line.args.configuration)
+
+
+def _serve_request(argv):
+    command_line.args = command_line.parse(argv)
+    tracing.reset(bool(command_line.args.trace))
+
+    # modules, sources and environment could change since last time
+    fsutils.stat_cache.clear()
+    variables.forget_environments()
+
+    try:
+        if (fsutils.pake_files_state(), command_line.args.configuration) != _served_state:
+            ui.debug("modules or configuration changed, parsing again")
+            _parse_for_server()
+
+        _do_what_was_requested()
+    except KeyboardInterrupt:
+        # client was interrupted
+        shell.interrupt()
+        ui.fatal("interrupted")
+
+
+def _serve():
+    _parse_for_server()
+    server.serve(_serve_request)
+
+
 def main():
+    # importing modules doesn't do anything, so everything
+    # (except the command line) is initialized from here
+    configurations.reset()
+    tracing.reset(bool(command_line.args.trace))
+
+    if command_line.args.server:
+        _serve()
+        return
+
     parse_source_tree()
+    _do_what_was_requested()
 
+
+def _save_trace():
+    if command_line.args.trace:
+        tracing.save(command_line.args.trace)
+        tracing.print_summary()
+
+
+def _do_what_was_requested():
     configuration = configurations.get_selected_configuration()
     if configuration.name != "__default":
         ui.bigstep("configuration", str(configurations.get_selected_configuration()))
 
-    if not _build_some_targets_if_requested():
+    try:
+        built = _build_some_targets_if_requested()
+    finally:
+        # failed builds are these which are the most interesting
+        _save_trace()
+
+    if not built:
         ui.info("no target selected\n")
 
         ui.info(ui.BOLD + "targets:" + ui.RESET)
@@ -48,4 +154,9 @@ def main():
         ui.info("\nsee --help for more\n")
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        # children have their own process groups, so they didn't get it
+        shell.interrupt()
+        ui.fatal("interrupted")
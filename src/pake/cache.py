@@ -0,0 +1,64 @@
+import os
+import cPickle as pickle
+
+import ui
+import fsutils
+
+# has to be bumped whenever parsed classes change
+_FORMAT_VERSION = 4
+
+
+class ModuleCache:
+    """ declarations of parsed modules, kept between the runs
+        and valid as long as module's mtime and size are the same """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__entries = {}
+        self.__dirty = False
+
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                version, entries = pickle.load(f)
+        except Exception as e:
+            ui.debug("no usable module cache in {}: {!s}".format(self.filename, e))
+            return
+
+        if version == _FORMAT_VERSION:
+            self.__entries = entries
+
+    def get(self, filename):
+        entry = self.__entries.get(filename)
+
+        if entry is not None and entry[0] == fsutils.stat_cache.get_stat(filename):
+            return entry[1]
+
+    def put(self, filename, declarations):
+        self.__entries[filename] = (fsutils.stat_cache.get_stat(filename), declarations)
+        self.__dirty = True
+
+    def save(self, existing_filenames):
+        """ modules which are gone are forgotten """
+        existing_filenames = set(existing_filenames)
+
+        for filename in list(self.__entries):
+            if filename not in existing_filenames:
+                del self.__entries[filename]
+                self.__dirty = True
+
+        if not self.__dirty:
+            return
+
+        ui.debug("saving module cache to {}".format(self.filename))
+
+        fsutils.mkdir_recursive(os.path.dirname(self.filename))
+
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "wb") as f:
+            pickle.dump((_FORMAT_VERSION, self.__entries), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary_filename, self.filename)
+
+        self.__dirty = False
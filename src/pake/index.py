@@ -0,0 +1,183 @@
+import os
+import marshal
+
+import ui
+import fsutils
+import variables
+
+_FORMAT_VERSION = 2
+
+
+def _referenced_modules(value):
+    """ names of the modules which variables used in value are coming from """
+    if isinstance(value, variables.ReferenceToVariable):
+        return set([value.module])
+    elif isinstance(value, (list, tuple)):
+        ret = set()
+        for element in value:
+            ret |= _referenced_modules(element)
+        return ret
+    elif hasattr(value, "__dict__"):
+        return _referenced_modules(list(vars(value).values()))
+
+    return set()
+
+
+def _static_dependencies(target):
+    """ None if dependencies can be known only after evaluating variables """
+    depends_on = target.common_parameters.depends_on.content
+
+    if all(isinstance(dependency, str) for dependency in depends_on):
+        return list(depends_on)
+
+
+def _has_hooks(target):
+    """ hooks can use variables of any module through the environment """
+    parameters = target.common_parameters
+    return bool(parameters.run_before.content or parameters.run_after.content)
+
+
+def describe(module_name, declarations):
+    """ index entry of the module, made from its declarations """
+    entry = {"module": module_name,
+             "targets": {},
+             "configurations": [],
+             "references": set()}
+
+    for kind, arguments in declarations:
+        if kind == "target":
+            target = arguments[0]
+            entry["targets"][target.common_parameters.name] = (_static_dependencies(target),
+                                                               _has_hooks(target))
+        elif kind == "configuration":
+            entry["configurations"].append(arguments[0].name)
+
+        entry["references"] |= _referenced_modules(arguments)
+
+    # this one is made from configuration exports, not a module
+    entry["references"].discard("__configuration")
+    entry["references"] = sorted(entry["references"])
+
+    return entry
+
+
+class ModuleIndex:
+    """ tells which modules define targets and configurations and which
+        modules they need, it's valid only as long as none of the modules
+        changed since it was made """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__entries = {}
+        self.__stats = {}
+        self.__dirty = False
+
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.filename, "rb") as f:
+                version, self.__stats, self.__entries = marshal.loads(f.read())
+        except (IOError, EOFError, ValueError, TypeError):
+            ui.debug("no usable module index in {}".format(self.filename))
+            return
+
+        if version != _FORMAT_VERSION:
+            self.__stats = {}
+            self.__entries = {}
+
+    def is_up_to_date(self, filenames):
+        if set(filenames) != set(self.__entries):
+            return False
+
+        return all(self.is_entry_up_to_date(filename) for filename in filenames)
+
+    def is_entry_up_to_date(self, filename):
+        return (filename in self.__entries and
+                self.__stats.get(filename) == fsutils.stat_cache.get_stat(filename))
+
+    def needed_filenames(self, filenames, target_names, configuration_name):
+        """ modules (in order of filenames) needed to build target_names,
+            None if it can't be told without parsing everything """
+        target_modules = {}
+        target_dependencies = {}
+        target_hooks = {}
+        configuration_modules = set()
+        module_filenames = {}
+
+        for filename in filenames:
+            entry = self.__entries[filename]
+            module = entry["module"]
+
+            module_filenames.setdefault(module, []).append(filename)
+
+            for target, (dependencies, hooks) in entry["targets"].items():
+                target_modules[target] = module
+                target_dependencies[target] = dependencies
+                target_hooks[target] = hooks
+
+            if configuration_name in entry["configurations"]:
+                configuration_modules.add(module)
+
+        if not configuration_modules and configuration_name != "__default":
+            return None
+
+        needed_modules = set(configuration_modules)
+
+        pending_targets = list(target_names)
+        seen_targets = set()
+        while pending_targets:
+            target = pending_targets.pop()
+
+            if target in seen_targets:
+                continue
+            seen_targets.add(target)
+
+            # dependencies made of variables and hooks (which get variables
+            # of all modules) can't do without parsing everything
+            if (target not in target_modules or target_dependencies[target] is None or
+                    target_hooks[target]):
+                return None
+
+            needed_modules.add(target_modules[target])
+            pending_targets.extend(target_dependencies[target])
+
+        pending_modules = list(needed_modules)
+        while pending_modules:
+            module = pending_modules.pop()
+            for filename in module_filenames.get(module, []):
+                for reference in self.__entries[filename]["references"]:
+                    if reference not in needed_modules:
+                        needed_modules.add(reference)
+                        pending_modules.append(reference)
+
+        return [filename for filename in filenames
+                if self.__entries[filename]["module"] in needed_modules]
+
+    def update(self, filename, entry):
+        self.__entries[filename] = entry
+        self.__stats[filename] = fsutils.stat_cache.get_stat(filename)
+        self.__dirty = True
+
+    def save(self, filenames):
+        filenames = set(filenames)
+
+        for filename in list(self.__entries):
+            if filename not in filenames:
+                del self.__entries[filename]
+                del self.__stats[filename]
+                self.__dirty = True
+
+        if not self.__dirty:
+            return
+
+        ui.debug("saving module index to {}".format(self.filename))
+
+        fsutils.mkdir_recursive(os.path.dirname(self.filename))
+
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "wb") as f:
+            f.write(marshal.dumps((_FORMAT_VERSION, self.__stats, self.__entries)))
+        os.rename(temporary_filename, self.filename)
+
+        self.__dirty = False
@@ -1,46 +1,7 @@
-import ui
-
-class FileReader:
-    def __init__(self, filename):
-        self.line_number = 1
-        self.column = 1
-
-        f = open(filename, "r")
-        self.position = 0
-        self.buf = f.read()
-        f.close()
-
-    def value(self):
-        if self.eof():
-            raise Exception("eof")
-
-        return str(self.buf[self.position])
-
-    def rewind(self, value = 1):
-        if value > 0:
-            for i in xrange(value):
-                self.column += 1
-                if not self.eof() and self.buf[self.position] == '\n':
-                    self.line_number += 1
-                    self.column = 1
-                self.position += 1
-        elif value < 0:
-            for i in xrange(-value):
-                self.position -= 1
-                self.column -= 1
-                if not self.eof() and self.buf[self.position] == '\n':
-                    self.line_number -= 1
-                    self.column = 1
-
-    def seek(self, value):
-        self.rewind(value - self.tell())
-
-    def tell(self):
-        return self.position
-
-    def eof(self):
-        return self.position >= len(self.buf) or self.position < 0
+import re
 
+import ui
+import tracing
 
 class FileLocation:
     def __init__(self, filename, line, column):
@@ -90,184 +51,79 @@ class Token:
         return self.token_type == other
 
 def parse(filename):
-    tokenizer = Tokenizer(filename)
+    with tracing.span(filename, "lexing"):
+        tokenizer = Tokenizer(filename)
     return tokenizer.tokens
 
 class Tokenizer:
+    # order matters, e.g. """ has to be tried before "
+    _REGEX = re.compile(r'''
+          (?P<comment>\#[^\n]*)
+        | (?P<escaped_newline>\\\n)
+        | (?P<newline>\n)
+        | (?P<open_parenthesis>\()
+        | (?P<close_parenthesis>\))
+        | (?P<colon>:)
+        | (?P<multiline_literal>""".*?""")
+        | (?P<unterminated_multiline_literal>""")
+        | (?P<quoted_literal>"[^"]*")
+        | (?P<unterminated_quoted_literal>")
+        | (?P<identifier>[A-Za-z0-9./$_\-=+]+)
+        | (?P<whitespace>[ ]+)
+        ''', re.VERBOSE | re.DOTALL)
+
+    _SIMPLE_TOKENS = {
+        "newline": (Token.NEWLINE, "<new-line>"),
+        "open_parenthesis": (Token.OPEN_PARENTHESIS, "("),
+        "close_parenthesis": (Token.CLOSE_PARENTHESIS, ")"),
+        "colon": (Token.COLON, ":")
+    }
+
     def __init__(self, filename):
         self.filename = filename
-        buf = FileReader(filename)
-        self.tokens = []
-        self.__tokenize(buf)
-        ui.debug("tokens: " + str(self.tokens))
 
-    def __is_valid_identifier_char(self, char):
-        return char.isalnum() or char in './$_-=+'
+        with open(filename, "r") as f:
+            buf = f.read()
 
-    def __try_add_variable_or_literal(self, token_type, data, line):
-        if len(data) > 0:
-            self.__add_token(token_type, data, line)
-        return ""
+        self.tokens = []
+        self.__tokenize(buf)
 
-    def __add_token(self, token_type, content, line = None):
+    def __add_token(self, token_type, content, line):
         token = Token(token_type, content, self.filename, line)
         self.tokens.append(token)
 
-    def __try_to_read_token(self, buf, what):
-        old_position = buf.tell()
-        what_position = 0
-
-        while not buf.eof() and what_position < len(what):
-            what_char = what[what_position]
-            char = buf.value()
-
-            if what_char != char:
-                break
-            else:
-                if what_position == len(what) - 1:
-                    buf.rewind()
-                    return True
-
-            buf.rewind()
-            what_position += 1
-
-        buf.seek(old_position)
-        return False
-
-    def __try_tokenize_multiline_literal(self, buf):
-        pos = buf.tell()
-        data = ''
-
-        if self.__try_to_read_token(buf, '"""'):
-            while True:
-                if buf.eof():
-                    raise Exception("parse error")
-
-                char = buf.value()
-
-                if self.__try_to_read_token(buf, '"""'):
-                    self.__add_token(Token.MULTILINE_LITERAL, data, buf.line_number)
-                    return True
-                else:
-                    data = data + char
-
-                buf.rewind()
-        else:
-            buf.seek(pos)
-
-        return False
-
-    def __try_tokenize_comment(self, buf):
-        if buf.value() == '#':
-            while not buf.eof() and buf.value() != '\n':
-                buf.rewind()
-            return True
-        return False
-
-    def __try_tokenize_slash_newline(self, buf):
-        if buf.eof():
-            return False
-
-        pos = buf.tell()
-
-        char = buf.value()
-        if char == "\\":
-            buf.rewind()
-            char = buf.value()
-            if char == "\n":
-                buf.rewind()
-                return True
-        buf.seek(pos)
-
-        return False
-
-    def __try_tokenize_simple_chars(self, buf):
-        if buf.eof():
-            return False
-
-        char = buf.value()
-
-        if char == '\n':
-            self.__add_token(Token.NEWLINE, "<new-line>", buf.line_number)
-            buf.rewind()
-            return True
-        elif char == '(':
-            self.__add_token(Token.OPEN_PARENTHESIS, "(", buf.line_number)
-            buf.rewind()
-            return True
-        elif char == ')':
-            self.__add_token(Token.CLOSE_PARENTHESIS, ")", buf.line_number)
-            buf.rewind()
-            return True
-        elif char == ':':
-            self.__add_token(Token.COLON, ":", buf.line_number)
-            buf.rewind()
-            return True
-
-        return False
-
-    def __try_tokenize_variable_or_literal(self, buf):
-        if buf.eof() or not self.__is_valid_identifier_char(buf.value()):
-            return False
-
-        if buf.value() == '$':  token_type = Token.VARIABLE
-        else:                   token_type = Token.LITERAL
-
-        data = ''
-        while not buf.eof():
-            c = buf.value()
-            if self.__is_valid_identifier_char(c):
-                data = data + c
-                buf.rewind()
-            else:
-                break
-
-        self.__try_add_variable_or_literal(token_type, data, buf.line_number)
-
-        return True
-
-    def __try_tokenize_quoted_literal(self, buf):
-        pos = buf.tell()
-        data = ''
-
-        if self.__try_to_read_token(buf, '"'):
-           while True:
-                if buf.eof():
-                    raise Exception("parse error")
-
-                if self.__try_to_read_token(buf, '"'):
-                    self.__add_token(Token.QUOTED_LITERAL, data, buf.line_number)
-                    return True
-                else:
-                    char = buf.value()
-                    data = data + char
-
-                buf.rewind()
-        else:
-            buf.seek(pos)
-
-        return False
-
-    def __try_tokenize_whitespace(self, buf):
-        ret = False
-        while not buf.eof() and buf.value() == ' ':
-            ret = True
-            buf.rewind()
-
-        return ret
-
     def __tokenize(self, buf):
-        while not buf.eof():
-            ret = any([self.__try_tokenize_comment(buf),
-                       self.__try_tokenize_slash_newline(buf),
-                       self.__try_tokenize_simple_chars(buf),
-                       self.__try_tokenize_quoted_literal(buf),
-                       self.__try_tokenize_variable_or_literal(buf),
-                       self.__try_tokenize_whitespace(buf),
-                       self.__try_tokenize_multiline_literal(buf)])
-
-            if not ret:
-                ui.parse_error(msg="unexpected character: " + str(buf.value()))
-
-            if buf.eof():
-                break
+        position = 0
+        line = 1
+        match = self._REGEX.match
+
+        while position < len(buf):
+            m = match(buf, position)
+
+            if m is None:
+                ui.parse_error(location=FileLocation(self.filename, line, None),
+                               msg="unexpected character: " + buf[position])
+
+            kind = m.lastgroup
+            text = m.group()
+
+            if kind in self._SIMPLE_TOKENS:
+                token_type, content = self._SIMPLE_TOKENS[kind]
+                self.__add_token(token_type, content, line)
+            elif kind.startswith("unterminated"):
+                ui.parse_error(location=FileLocation(self.filename, line, None),
+                               msg="unterminated literal")
+
+            # literals spanning few lines are reported at the line they end
+            line += text.count("\n")
+
+            if kind == "identifier":
+                if text[0] == '$': token_type = Token.VARIABLE
+                else:              token_type = Token.LITERAL
+                self.__add_token(token_type, text, line)
+            elif kind == "quoted_literal":
+                self.__add_token(Token.QUOTED_LITERAL, text[1:-1], line)
+            elif kind == "multiline_literal":
+                self.__add_token(Token.MULTILINE_LITERAL, text[3:-3], line)
+
+            position = m.end()
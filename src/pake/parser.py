@@ -1,15 +1,122 @@
 import os
 
 import ui
+import fsutils
+import tracing
 from . import lexer
+from . import cache
+from . import index
 import targets
 import variables
 import configurations
 
 from variables import Variable
 
+_module_cache = None
+_module_index = None
+
+# things which module declares, they are remembered by
+# the cache and applied again without parsing the module
+_DECLARATIONS = {
+    "add": variables.add,
+    "append": variables.append,
+    "add_empty": variables.add_empty,
+    "target": targets.add_target,
+    "configuration": configurations.add_configuration
+}
+
+
+def _get_module_cache():
+    global _module_cache
+
+    if _module_cache is None:
+        _module_cache = cache.ModuleCache(os.path.join(fsutils.BUILD_ROOT, "modules.cache"))
+
+    return _module_cache
+
+
+def reset():
+    """ declarations are applied (and then evaluated) as they are, so
+        parsing again has to read them from the cache file, not reuse
+        these which already hold values of the last parse """
+    global _module_cache
+
+    _module_cache = None
+
+
+def _get_module_index():
+    global _module_index
+
+    if _module_index is None:
+        _module_index = index.ModuleIndex(os.path.join(fsutils.BUILD_ROOT, "modules.index"))
+
+    return _module_index
+
+
+def module_name(filename):
+    base = os.path.basename(filename)
+    (root, ext) = os.path.splitext(base)
+    return root
+
+
+def _apply(declarations):
+    for kind, arguments in declarations:
+        _DECLARATIONS[kind](*arguments)
+
+
+def _load(filename):
+    module_cache = _get_module_cache()
+    declarations = module_cache.get(filename)
+
+    if declarations is None:
+        with tracing.span(filename, "parsing"):
+            declarations = Module(filename).declarations
+        module_cache.put(filename, declarations)
+    else:
+        ui.debug("{} loaded from cache".format(filename))
+
+    return declarations
+
+
 def parse(filename):
-    Module(filename)
+    _apply(_load(filename))
+
+
+def parse_all(filenames):
+    """ parses every module and remembers what they define """
+    module_index = _get_module_index()
+
+    for filename in filenames:
+        declarations = _load(filename)
+        if not module_index.is_entry_up_to_date(filename):
+            module_index.update(filename, index.describe(module_name(filename), declarations))
+        _apply(declarations)
+
+    _get_module_cache().save(filenames)
+    module_index.save(filenames)
+
+
+def parse_needed(filenames, target_names, configuration_name):
+    """ parses only modules needed to build target_names, returns False
+        if they can't be told from the index made by last parse_all """
+    module_index = _get_module_index()
+
+    if not module_index.is_up_to_date(filenames):
+        ui.debug("module index is out of date")
+        return False
+
+    needed_filenames = module_index.needed_filenames(filenames, target_names, configuration_name)
+
+    if needed_filenames is None:
+        ui.debug("can't tell which modules are needed from the index")
+        return False
+
+    ui.debug("parsing {} of {} modules".format(len(needed_filenames), len(filenames)))
+
+    for filename in needed_filenames:
+        parse(filename)
+
+    return True
 
 class CommonTargetParameters:
     def __init__(self, root_path, module_name, name):
@@ -33,6 +140,8 @@ class CxxParameters:
         self.sources = Variable()
         self.include_dirs = Variable()
         self.compiler_flags = Variable()
+        self.precompiled_header = Variable()
+        self.unity_build = Variable()
         self.built_targets = Variable()
 
 
@@ -44,36 +153,37 @@ class Module:
 
         with ui.ident:
             self.filename = filename
-            self.name = self.__get_module_name(filename)
+            self.name = module_name(filename)
+            self.declarations = []
 
             self.tokens = lexer.parse(filename)
 
             self.__parse()
 
-            variables.add(
+            self.__declare(
+                "add",
                 self.name,
                 "$__path",
                 os.path.dirname(filename))
 
-            variables.add_empty(
+            self.__declare(
+                "add_empty",
                 self.name,
                 "$__null")
 
+    def __declare(self, kind, *arguments):
+        self.declarations.append((kind, arguments))
+
     def _token_to_variable(self, token):
         if token == lexer.Token.LITERAL:
             return token.content
         elif token == lexer.Token.VARIABLE:
             return variables.ReferenceToVariable(self.name, token.content)
-        elif token == lexer.Token.QUOTED_LITERAL:
-            return variables.Literal(self.name, token.content)
+        elif token in [lexer.Token.QUOTED_LITERAL, lexer.Token.MULTILINE_LITERAL]:
+            return variables.Literal(self.name, token.content, token.location)
 
         return None
 
-    def __get_module_name(self, filename):
-        base = os.path.basename(filename)
-        (root, ext) = os.path.splitext(base)
-        return root
-
     def __parse_set_or_append(self, it, append):
         token = it.next()
         if token == lexer.Token.VARIABLE:
@@ -89,9 +199,9 @@ class Module:
 
             if variable:
                 if append or second_add:
-                    variables.append(self.name, variable_name, variable)
+                    self.__declare("append", self.name, variable_name, variable)
                 else:
-                    variables.add(self.name, variable_name, variable)
+                    self.__declare("add", self.name, variable_name, variable)
                     second_add = True
 
             elif token == lexer.Token.NEWLINE:
@@ -181,6 +291,12 @@ class Module:
         elif token.content == "compiler_flags":
             cxx_parameters.compiler_flags = self.__parse_list(it)
             return True
+        elif token.content == "precompiled_header":
+            cxx_parameters.precompiled_header = self.__parse_list(it)
+            return True
+        elif token.content == "unity_build":
+            cxx_parameters.unity_build = self.__parse_list(it)
+            return True
 
         return False
 
@@ -209,7 +325,7 @@ class Module:
                 ui.parse_error(token)
 
         target = targets.Application(common_parameters, cxx_parameters, link_with, library_dirs)
-        targets.add_target(target)
+        self.__declare("target", target)
 
     def __parse_static_library(self, target_name, it):
         common_parameters = CommonTargetParameters(
@@ -231,7 +347,7 @@ class Module:
                 ui.parse_error(token)
 
         target = targets.StaticLibrary(common_parameters, cxx_parameters)
-        targets.add_target(target)
+        self.__declare("target", target)
 
     def __parse_phony(self, target_name, it):
         common_parameters = CommonTargetParameters(
@@ -255,7 +371,7 @@ class Module:
                 ui.parse_error(token)
 
         target = targets.Phony(common_parameters)
-        targets.add_target(target)
+        self.__declare("target", target)
 
     def __parse_target(self, it):
         token = it.next()
@@ -293,6 +409,9 @@ class Module:
                 elif token.content == "application_suffix": configuration.application_suffix = self.__parse_list(it)
                 elif token.content == "compiler_flags": configuration.compiler_flags = self.__parse_list(it)
                 elif token.content == "linker_flags": configuration.linker_flags = self.__parse_list(it)
+                elif token.content == "dependency_scan": configuration.dependency_scan = self.__parse_list(it)
+                elif token.content == "change_detection": configuration.change_detection = self.__parse_list(it)
+                elif token.content == "unity_build": configuration.unity_build = self.__parse_list(it)
                 elif token.content == "export": configuration.export = self._parse_configuration_export(it)
                 else: ui.parse_error(token)
 
@@ -302,7 +421,7 @@ class Module:
                 ui.parse_error(token)
 
         ui.debug("configuration parsed:" + str(configuration))
-        configurations.add_configuration(configuration)
+        self.__declare("configuration", configuration)
 
     def __parse_directive(self, it):
         while True:
@@ -0,0 +1,332 @@
+import os
+import sys
+import time
+import tempfile
+import fcntl
+import errno
+import select
+import signal
+import threading
+import subprocess
+import collections
+
+import ui
+
+
+class OutputBuffer:
+    """ output of a process is kept until it finishes, so outputs of
+        processes running in parallel don't get mixed, when there is
+        too much of it, it goes to a temporary file """
+
+    MEMORY_LIMIT = 1024 * 1024
+
+    def __init__(self):
+        self.__chunks = []
+        self.__size = 0
+        self.__file = None
+
+    def write(self, data):
+        if self.__file is not None:
+            self.__file.write(data)
+            return
+
+        self.__chunks.append(data)
+        self.__size += len(data)
+
+        if self.__size > self.MEMORY_LIMIT:
+            self.__file = tempfile.TemporaryFile()
+            self.__file.write("".join(self.__chunks))
+            self.__chunks = []
+
+    def emit(self, error):
+        """ prints everything at once """
+        if self.__file is not None:
+            self.__file.seek(0)
+            ui.output(self.__file, error)
+        elif self.__chunks:
+            ui.output("".join(self.__chunks), error)
+
+
+class Process:
+    """ child process started by the engine """
+
+    def __init__(self, command, shell, capture_output, cwd, env):
+        self.command = command
+        self.shell = shell
+        self.capture_output = capture_output
+        self.cwd = cwd
+        self.env = env
+
+        self.popen = None
+        self.returncode = None
+        self.output = []
+        self.stdout = OutputBuffer()
+        self.stderr = OutputBuffer()
+        self.error = None
+        self.started = None
+        self.duration = None
+        self.open_streams = 0
+        self.own_group = True
+
+        self.__finished = threading.Event()
+
+    def finish(self, returncode=None, error=None):
+        self.returncode = returncode
+        self.error = error
+        if self.started is not None:
+            self.duration = time.time() - self.started
+        self.__finished.set()
+
+    def wait(self):
+        """ returns exit code, OSError is raised if it couldn't be started """
+        # wait without timeout can't be interrupted in python 2
+        while not self.__finished.wait(0.1):
+            pass
+
+        if self.error is not None:
+            raise self.error
+
+        return self.returncode
+
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _is_foreground():
+    """ pake has the terminal, so its children can use it too """
+    try:
+        return os.tcgetpgrp(sys.stdin.fileno()) == os.getpgrp()
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+class Engine:
+    """ runs child processes from a single event loop thread, their output
+        is read as soon as it comes, and they are reaped when they finish,
+        every child gets its own process group, so kill_all() takes down
+        also whatever it has started (e.g. cc1plus run by g++), except
+        shell commands written by the user when pake runs in the terminal,
+        they stay in pake's group, so they can use it and get Ctrl-C like
+        pake does, shells are done when they exit, even if something they
+        left in the background still holds the output (e.g. "server &") """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__queue = collections.deque()
+        self.__streams = {}
+        self.__orphans = {}
+        self.__running = set()
+        self.__exiting = set()
+        self.__exited = []
+        self.__poll = select.poll()
+        self.__thread = None
+
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        _set_cloexec(self.__wakeup_read)
+        _set_cloexec(self.__wakeup_write)
+        self.__poll.register(self.__wakeup_read, select.POLLIN)
+
+    def spawn(self, command, shell=False, capture_output=False, cwd=None, env=None):
+        process = Process(command, shell, capture_output, cwd, env)
+
+        with self.__lock:
+            self.__queue.append(process)
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__loop)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        os.write(self.__wakeup_write, "x")
+        return process
+
+    def kill_all(self):
+        with self.__lock:
+            running = list(self.__running)
+
+        for process in running:
+            try:
+                if process.own_group:
+                    ui.debug("killing process group {}".format(process.popen.pid))
+                    os.killpg(process.popen.pid, signal.SIGTERM)
+                else:
+                    ui.debug("killing process {}".format(process.popen.pid))
+                    os.kill(process.popen.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def __loop(self):
+        while True:
+            self.__start_queued()
+
+            # some children closed their output, but didn't exit yet
+            timeout = 10 if self.__exiting else None
+
+            for fd, _ in self.__poll_ignoring_eintr(timeout):
+                if fd == self.__wakeup_read:
+                    os.read(fd, 4096)
+                else:
+                    self.__read(fd)
+
+            with self.__lock:
+                exited, self.__exited = self.__exited, []
+
+            for process in exited + list(self.__exiting):
+                self.__try_reap(process)
+
+    def __poll_ignoring_eintr(self, timeout):
+        try:
+            return self.__poll.poll(timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+
+    def __start_queued(self):
+        while True:
+            with self.__lock:
+                if not self.__queue:
+                    return
+                process = self.__queue.popleft()
+
+            self.__start(process)
+
+    def __start(self, process):
+        process.started = time.time()
+        process.own_group = not (process.shell and _is_foreground())
+
+        try:
+            process.popen = subprocess.Popen(process.command,
+                                             shell=process.shell,
+                                             cwd=process.cwd,
+                                             env=process.env,
+                                             stdout=subprocess.PIPE,
+                                             stderr=subprocess.PIPE,
+                                             preexec_fn=os.setpgrp if process.own_group else None)
+        except OSError as e:
+            process.finish(error=e)
+            return
+
+        with self.__lock:
+            self.__running.add(process)
+
+        # captured output goes straight to process.output
+        stdout_buffer = None if process.capture_output else process.stdout
+
+        for stream, buffer in [(process.popen.stdout, stdout_buffer),
+                               (process.popen.stderr, process.stderr)]:
+            _set_cloexec(stream.fileno())
+            self.__streams[stream.fileno()] = (process, stream, buffer)
+            self.__poll.register(stream.fileno(), select.POLLIN)
+            process.open_streams += 1
+
+        if process.shell:
+            # whatever is left is drained once the shell exits
+            for stream in [process.popen.stdout, process.popen.stderr]:
+                _set_nonblocking(stream.fileno())
+
+            waiter = threading.Thread(target=self.__wait_for_shell, args=(process,))
+            waiter.daemon = True
+            waiter.start()
+
+    def __wait_for_shell(self, process):
+        """ shell can exit long before its output is closed, it's waited
+            for here, so the loop doesn't have to poll for it """
+        process.popen.wait()
+
+        with self.__lock:
+            self.__exited.append(process)
+
+        os.write(self.__wakeup_write, "x")
+
+    def __read(self, fd):
+        """ returns False when there is nothing more to read for now """
+        try:
+            data = os.read(fd, 65536)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return False
+
+        if fd in self.__orphans:
+            self.__read_orphan(fd, data)
+            return False
+
+        process, stream, buffer = self.__streams[fd]
+
+        if not data:
+            self.__poll.unregister(fd)
+            del self.__streams[fd]
+            stream.close()
+
+            process.open_streams -= 1
+            if process.open_streams == 0 and not process.shell:
+                self.__exiting.add(process)
+            return False
+        elif buffer is None:
+            process.output.append(data)
+        else:
+            buffer.write(data)
+
+        return True
+
+    def __read_orphan(self, fd, data):
+        """ output of processes left in the background goes out as it
+            comes, they'd get SIGPIPE if nobody was reading it """
+        stream, error = self.__orphans[fd]
+
+        if not data:
+            del self.__orphans[fd]
+            self.__poll.unregister(fd)
+            stream.close()
+        else:
+            ui.output(data, error)
+
+    def __try_reap(self, process):
+        returncode = process.popen.poll()
+
+        if returncode is None:
+            return
+
+        # processes left in the background by the shell might keep
+        # the pipes open for long, so only what's there already is taken
+        for fd in [fd for fd, (owner, _, _) in self.__streams.items()
+                   if owner is process]:
+            while self.__read(fd):
+                pass
+            if fd in self.__streams:
+                _, stream, _ = self.__streams.pop(fd)
+                self.__orphans[fd] = (stream, stream is process.popen.stderr)
+
+        self.__exiting.discard(process)
+
+        with self.__lock:
+            self.__running.discard(process)
+
+        process.stdout.emit(error=False)
+        process.stderr.emit(error=True)
+
+        process.finish(returncode)
+
+        ui.debug("{} finished in {:.3f}s".format(process.popen.pid, process.duration))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def engine():
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = Engine()
+
+        return _engine
@@ -0,0 +1,153 @@
+import time
+import collections
+import threading
+
+import ui
+import tracing
+
+
+class Job:
+    def __init__(self, name, function, dependencies):
+        self.name = name
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.dependants = []
+        self.waiting_for = 0
+        self.duration = None
+
+    def __repr__(self):
+        return self.name
+
+
+class Scheduler:
+    """ runs jobs from the whole build graph on a fixed number
+        of workers, job is started as soon as all jobs it depends
+        on are finished, after first failure, jobs which are still
+        waiting in the queue are cancelled """
+
+    def __init__(self, jobs):
+        self.jobs = max(1, int(jobs))
+        self.errors = []
+
+        self.__all_jobs = []
+        self.__ready = collections.deque()
+        self.__condition = threading.Condition()
+        self.__running = 0
+        self.__left = 0
+        self.__cancelled = False
+
+    def add(self, name, function, dependencies=[]):
+        job = Job(name, function, dependencies)
+        self.__all_jobs.append(job)
+        return job
+
+    def run(self):
+        for job in self.__all_jobs:
+            job.waiting_for = len(job.dependencies)
+            for dependency in job.dependencies:
+                dependency.dependants.append(job)
+
+        self.__ready.extend(job for job in self.__all_jobs if job.waiting_for == 0)
+        self.__left = len(self.__all_jobs)
+
+        workers_count = min(self.jobs, len(self.__all_jobs))
+        ui.debug("running {} jobs on {} workers".format(self.__left, workers_count))
+
+        workers = []
+        for i in range(workers_count):
+            worker = threading.Thread(target=self.__worker)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            for worker in workers:
+                # join without timeout can't be interrupted in python 2
+                while worker.is_alive():
+                    worker.join(0.1)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+        return not self.errors
+
+    def cancel(self):
+        """ jobs which are already running are let to finish """
+        with self.__condition:
+            self.__cancelled = True
+            self.__ready.clear()
+            self.__condition.notify_all()
+
+    def __take_job(self):
+        with self.__condition:
+            while not self.__ready and self.__left > 0 and self.__running > 0:
+                self.__condition.wait()
+
+            if not self.__ready or self.__cancelled:
+                return None
+
+            self.__running += 1
+            return self.__ready.popleft()
+
+    def __finish_job(self, job, succeeded):
+        with self.__condition:
+            self.__running -= 1
+            self.__left -= 1
+
+            if not succeeded:
+                ui.debug("cancelling {} queued jobs".format(len(self.__ready)))
+                self.__cancelled = True
+                self.__ready.clear()
+            elif not self.__cancelled:
+                for dependant in job.dependants:
+                    dependant.waiting_for -= 1
+                    if dependant.waiting_for == 0:
+                        self.__ready.append(dependant)
+
+            self.__condition.notify_all()
+
+    def critical_path(self):
+        """ chain of finished jobs which took the longest """
+        longest = {}
+
+        # jobs are added after their dependencies
+        for job in self.__all_jobs:
+            if job.duration is None:
+                continue
+
+            before = [longest[dependency] for dependency in job.dependencies
+                      if dependency in longest]
+            path_before = max(before, key=lambda path: path[0]) if before else (0, [])
+
+            longest[job] = (path_before[0] + job.duration, path_before[1] + [job])
+
+        if not longest:
+            return []
+
+        return max(longest.values(), key=lambda path: path[0])[1]
+
+    def __execute(self, job):
+        ui.debug("starting job: {}".format(job))
+        started = time.time()
+        try:
+            job.function()
+            return True
+        except SystemExit:
+            # ui.fatal already told the user what happened
+            self.errors.append((job, "fatal error"))
+        except Exception as e:
+            ui.debug("job {} failed: {!s}".format(job, e))
+            self.errors.append((job, str(e)))
+        finally:
+            job.duration = time.time() - started
+            tracing.add(job.name, "job", started, job.duration)
+        return False
+
+    def __worker(self):
+        while True:
+            job = self.__take_job()
+
+            if job is None:
+                return
+
+            self.__finish_job(job, self.__execute(job))
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import threading
+import contextlib
+
+import ui
+import client
+
+
+class _Stopped(BaseException):
+    pass
+
+
+def _stop(signum, frame):
+    raise _Stopped()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+class _Channel:
+    """ file-like object sending everything it gets to the client """
+
+    def __init__(self, connection, channel):
+        self.connection = connection
+        self.channel = channel
+
+    def write(self, data):
+        try:
+            client.send_message(self.connection, self.channel, data)
+        except socket.error as e:
+            # client is gone (e.g. it was interrupted), build goes on
+            if e.errno != errno.EPIPE:
+                raise
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _read_request(connection):
+    data = ""
+    while not data.endswith("\n"):
+        chunk = connection.recv(4096)
+        if not chunk:
+            raise EOFError("client closed the connection")
+        data += chunk
+    return json.loads(data, encoding="latin-1")
+
+
+def _bytes(value):
+    """ client sends everything as latin-1 """
+    return value.encode("latin-1")
+
+
+@contextlib.contextmanager
+def _environment(environment):
+    """ build and commands it runs see environment of the client """
+    original = dict(os.environ)
+
+    os.environ.clear()
+    os.environ.update(environment)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(original)
+
+
+class _ClientWatch:
+    """ client closes the connection when it's interrupted, the request
+        is then interrupted as well, just like pake is by Ctrl-C """
+
+    def __init__(self, connection):
+        self.__lock = threading.Lock()
+        self.__finished = False
+
+        watch = threading.Thread(target=self.__watch, args=(connection,))
+        watch.daemon = True
+        watch.start()
+
+    def __watch(self, connection):
+        try:
+            # client doesn't send anything more
+            connection.recv(1)
+        except socket.error:
+            pass
+
+        with self.__lock:
+            if not self.__finished:
+                ui.debug("client went away, interrupting its request")
+                os.kill(os.getpid(), signal.SIGUSR1)
+
+    def finish(self):
+        with self.__lock:
+            self.__finished = True
+
+
+def _handle(connection, run):
+    request = _read_request(connection)
+    ui.debug("request: {!s}".format(request["argv"]))
+
+    environment = dict((_bytes(name), _bytes(value))
+                       for name, value in request["env"].items())
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _Channel(connection, client.STDOUT)
+    sys.stderr = _Channel(connection, client.STDERR)
+
+    client_watch = _ClientWatch(connection)
+
+    try:
+        if request["cwd"] != os.getcwd():
+            ui.fatal("server is running in {}".format(os.getcwd()))
+
+        with _environment(environment):
+            run([_bytes(argument) for argument in request["argv"]])
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    finally:
+        client_watch.finish()
+        ui.flush()
+        sys.stdout, sys.stderr = stdout, stderr
+
+    try:
+        client.send_message(connection, client.EXIT, str(exit_code))
+    except socket.error:
+        pass
+
+
+def _close(connection):
+    # shutdown wakes up the client watch, close alone doesn't
+    try:
+        connection.shutdown(socket.SHUT_RDWR)
+    except socket.error:
+        pass
+    connection.close()
+
+
+def serve(run):
+    """ handles requests of pake clients, one at a time, run(argv) is
+        supposed to do what pake would do if it was started with argv """
+    filename = client.socket_filename()
+
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(filename)
+    listener.listen(16)
+
+    # so the socket is removed, even if it happens in the middle of a request
+    signal.signal(signal.SIGTERM, _stop)
+
+    # SIGINT might be ignored when the server runs in the background
+    signal.signal(signal.SIGUSR1, _interrupt)
+
+    ui.bigstep("serving", filename)
+
+    try:
+        while True:
+            connection, _ = listener.accept()
+            try:
+                _handle(connection, run)
+            except (EOFError, ValueError, KeyError, socket.error) as e:
+                ui.debug("broken request: {!s}".format(e))
+            except KeyboardInterrupt:
+                # client went away right when its request was finished
+                ui.debug("interrupted after request was finished")
+            finally:
+                _close(connection)
+    except _Stopped:
+        ui.bigstep("stopping", filename)
+    finally:
+        listener.close()
+        os.remove(filename)
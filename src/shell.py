@@ -1,24 +1,57 @@
-import subprocess
+import errno
+import pipes
 
 import ui
+import processes
 
 _counter = 0
 
-def execute(command, capture_output = False):
+
+def format_command(command):
+    """ command as it could be typed in the shell """
+    if isinstance(command, basestring):
+        return command
+
+    return " ".join(pipes.quote(argument) for argument in command)
+
+
+def execute(command, capture_output = False, cwd = None, env = None):
+    """ list of arguments is run directly, string goes through /bin/sh,
+        which is needed only for commands written by the user, it waits
+        until the process, run by the processes engine, is finished """
     global _counter
 
     _counter += 1
 
-    ui.debug("running {!s}: {!s}".format(_counter, command))
+    use_shell = isinstance(command, basestring)
+
+    ui.debug("running {!s}: {!s}".format(_counter, format_command(command)))
+
+    try:
+        process = _run(command, use_shell, capture_output, cwd, env)
+    except OSError as e:
+        raise Exception("cannot run {}: {}".format(format_command(command), e.strerror))
+
+    if process.returncode != 0:
+        raise Exception("command exited with error({}): {}".format(str(process.returncode), format_command(command)))
+
+    return "".join(process.output)
+
+
+def _run(command, use_shell, capture_output, cwd, env):
+    process = processes.engine().spawn(command, use_shell, capture_output, cwd, env)
 
-    out = ''
     try:
-        if capture_output:
-            out = subprocess.check_output(command, shell=True)
-        else:
-            subprocess.check_call(command, shell=True)
-    except subprocess.CalledProcessError as e:
-        raise Exception("command exited with error({}): {}".format(str(e.returncode), command))
+        process.wait()
+        return process
+    except OSError as e:
+        # scripts without #! are run by the shell, just like the shell does
+        if e.errno != errno.ENOEXEC or use_shell:
+            raise
+
+        return _run(["/bin/sh"] + command, False, capture_output, cwd, env)
 
-    return out
 
+def interrupt():
+    """ kills everything what was started """
+    processes.engine().kill_all()
@@ -1,16 +1,24 @@
 import os
-import threading
+import time
 
 import ui
 import fsutils
 import compiler
+import database
+import objectcache
 import shell
 import variables
 import configurations
 import command_line
+import tracing
+import watcher
+from scheduler import Scheduler
 
 targets = {}
-_built_targets = []
+
+
+def reset():
+    targets.clear()
 
 
 def add_target(target):
@@ -18,65 +26,176 @@ def add_target(target):
 
     targets[target.common_parameters.name] = target
 
-def _build_and_track_single_target(name):
-    """ tracking means putting it to special
-        container, when this function is called
-        with the same target, it will be skipped """
-    configuration = configurations.get_selected_configuration()
+class Milestones:
+    """ jobs which other targets can wait for, ready means that target
+        prepared everything needed to compile things depending on it
+        (e.g. generated headers) and done means that whole target is
+        built """
 
-    fsutils.make_build_dir(configuration.name)
+    def __init__(self, ready, done):
+        self.ready = ready
+        self.done = done
 
-    ui.debug("building {} with configuration {!s}".format(name, configuration))
 
-    with ui.ident:
-        if name in _built_targets:
-            ui.debug("{} already build, skipping".format(name))
-            return
-        else:
-            _built_targets.append(name)
+def _schedule_target(scheduler, toolchain, name, scheduled, path=[]):
+    if name in scheduled:
+        ui.debug("{} already scheduled, skipping".format(name))
+        return scheduled[name]
 
-        if name not in targets:
-            ui.fatal("target {} not found".format(name))
+    if name in path:
+        ui.fatal("circular dependency: {}".format(" -> ".join(path + [name])))
 
+    if name not in targets:
+        ui.fatal("target {} not found".format(name))
+
+    configuration = configurations.get_selected_configuration()
+
+    ui.debug("scheduling {} with configuration {!s}".format(name, configuration))
+
+    with ui.ident:
         target = targets[name]
 
         if not target.is_visible(configuration):
             ui.fatal("target {} is not visible in {!s}"
                      .format(name, configuration))
 
+        dependencies = []
         for dependency in target.common_parameters.depends_on.eval():
             ui.debug("{} depends on {}".format(name, dependency))
-            build(dependency)
+            dependencies.append(_schedule_target(scheduler, toolchain, dependency,
+                                                 scheduled, path + [name]))
 
-        toolchain = compiler.Gnu()
+        scheduled[name] = target.schedule(scheduler, toolchain, dependencies)
+        return scheduled[name]
 
-        target.before()
-        target.build(toolchain)
-        target.after()
-        target.copy_resources(toolchain)
 
+def _build_targets(names):
+    configuration = configurations.get_selected_configuration()
 
-def _clear_tracked_targets():
-    _built_targets = []
+    fsutils.make_build_dir(configuration.name)
 
+    build_database = database.Database(database.filename(configuration.name))
+    object_cache = None
+    if command_line.args.object_cache:
+        object_cache = objectcache.ObjectCache(command_line.args.object_cache,
+                                               int(command_line.args.object_cache_size) * 1024 * 1024)
 
-def build(name):
-    _build_and_track_single_target(name)
-    _clear_tracked_targets()
+    toolchain = compiler.Gnu(build_database, object_cache)
+    jobs = command_line.args.jobs
+    scheduler = Scheduler(jobs)
+    ui.debug("limiting jobs to {!s}".format(jobs))
 
+    scheduled = {}
+    for name in names:
+        _schedule_target(scheduler, toolchain, name, scheduled)
 
-def build_all():
-    ui.bigstep("building all targets", " ".join(targets))
+    try:
+        succeeded = scheduler.run()
+    finally:
+        # whatever was built until Ctrl-C doesn't have to be built again
+        build_database.save()
+
+    if tracing.enabled:
+        tracing.set_critical_path((job.name, job.duration) for job in scheduler.critical_path())
+
+    if object_cache is not None:
+        object_cache.trim()
+
+    ui.debug("stat cache: {} hits, {} misses"
+             .format(fsutils.stat_cache.hits, fsutils.stat_cache.misses))
 
+    if not succeeded:
+        job, reason = scheduler.errors[0]
+        ui.fatal("failed building {!s}: {!s}".format(job, reason))
+
+
+def build(names):
+    _build_targets(names)
+
+
+def visible_names():
     configuration = configurations.get_selected_configuration()
 
+    names = []
     for name, target in targets.items():
         if target.is_visible(configuration):
-            _build_and_track_single_target(name)
+            names.append(name)
         else:
             ui.bigstep("skip", name)
 
-    _clear_tracked_targets()
+    return names
+
+
+def build_all():
+    ui.bigstep("building all targets", " ".join(targets))
+
+    _build_targets(visible_names())
+
+
+def _with_dependencies(name, result=None):
+    if result is None:
+        result = set()
+
+    if name not in result and name in targets:
+        result.add(name)
+        for dependency in targets[name].common_parameters.depends_on.eval():
+            _with_dependencies(dependency, result)
+
+    return result
+
+
+def _files_of_targets(names):
+    """ files which targets are made of, with targets using them """
+    configuration = configurations.get_selected_configuration()
+    build_database = database.Database(database.filename(configuration.name))
+    toolchain = compiler.Gnu(build_database)
+
+    files = {}
+    for name in set().union(*[_with_dependencies(name) for name in names]):
+        for filename in targets[name].watched_files(toolchain, build_database):
+            files.setdefault(filename, set()).add(name)
+
+    return files
+
+
+def watch(names):
+    """ builds targets and then, whenever files they are made of change,
+        builds these of them which are affected, returns when some
+        of pake modules changes, so they have to be parsed again """
+    file_watcher = watcher.create()
+    to_build = names
+
+    while True:
+        started = time.time()
+
+        try:
+            _build_targets(to_build)
+        except SystemExit:
+            # ui.fatal already told what is wrong
+            pass
+
+        fsutils.stat_cache.clear()
+        files = _files_of_targets(names)
+        watched = list(files) + fsutils.pake_files()
+
+        # before the check, so changes made right after it aren't missed
+        file_watcher.watch(watched)
+
+        # they could be changed while building
+        changed = set(filename for filename in files
+                      if (fsutils.get_mtime_if_exists(filename) or 0) > started)
+
+        if not changed:
+            ui.bigstep("watching", "{} files".format(len(files)))
+            changed = file_watcher.wait(watched)
+
+        if any(filename.endswith(".pake") for filename in changed):
+            return
+
+        affected = set().union(*[files.get(filename, set()) for filename in changed])
+        to_build = [name for name in names if _with_dependencies(name) & affected]
+
+        fsutils.stat_cache.clear()
 
 
 class Target:
@@ -95,6 +214,27 @@ class Target:
                                         self.common_parameters.name,
                                         ', '.join([] + ra + rb))
 
+    def schedule(self, scheduler, toolchain, dependencies):
+        name = self.common_parameters.name
+
+        # commands from run_before might use anything what dependencies
+        # produce, otherwise it's enough that they are ready
+        if self.common_parameters.run_before.eval():
+            wait_for = [dependency.done for dependency in dependencies]
+        else:
+            wait_for = [dependency.ready for dependency in dependencies]
+
+        before = scheduler.add(name + " (run_before)", self.before, wait_for)
+        built = self.schedule_build(scheduler, toolchain, before, dependencies)
+        after = scheduler.add(name + " (run_after)", self.after, [built])
+        done = scheduler.add(name + " (resources)",
+                             lambda: self.copy_resources(toolchain), [after])
+
+        return Milestones(self.ready_job(before, done), done)
+
+    def ready_job(self, before, done):
+        return before
+
     def before(self):
         self.__try_run(self.common_parameters.run_before)
 
@@ -102,16 +242,12 @@ class Target:
         self.__try_run(self.common_parameters.run_after)
 
     def copy_resources(self, toolchain):
-        root_dir = os.getcwd()
-        os.chdir(self.common_parameters.root_path)
-
         for resource in self.common_parameters.resources.eval():
             ui.step("copy", resource)
             shell.execute("rsync --update -r '{resource}' '{build_dir}/'"
                           .format(resource=resource,
-                                  build_dir=toolchain.build_dir()))
-
-        os.chdir(root_dir)
+                                  build_dir=toolchain.build_dir()),
+                          cwd=self.common_parameters.root_path)
 
     def is_visible(self, configuration):
         evaluated_visible_in = self.common_parameters.visible_in.eval()
@@ -121,14 +257,22 @@ class Target:
 
         return True
 
+    def path(self, filename):
+        return os.path.join(self.common_parameters.root_path, filename)
+
+    def watched_files(self, toolchain, build_database):
+        return [self.path(prerequisite)
+                for prerequisite in self.common_parameters.prerequisites.eval()]
+
     def __are_explicit_prerequisities_newer(self, artefacts, prerequisites):
         ui.debug("checking prerequisites ({!s}) for making {!s}"
                  .format(prerequisites, artefacts))
 
         if prerequisites and artefacts:
+            prerequisites = [self.path(prerequisite) for prerequisite in prerequisites]
             for artefact in artefacts:
                 ui.debug("  " + artefact)
-                if fsutils.is_any_newer_than(prerequisites, artefact):
+                if fsutils.is_any_newer_than(prerequisites, self.path(artefact)):
                     ui.debug(("going on because {!s}"
                               "needs to be rebuilt").format(artefact))
                     return True
@@ -140,9 +284,6 @@ class Target:
         evaluated_cmds = cmds.eval()
 
         if evaluated_cmds:
-            root_dir = os.getcwd()
-            os.chdir(self.common_parameters.root_path)
-
             evaluated_artefacts = self.common_parameters.artefacts.eval()
             evaluated_prerequisites = self.common_parameters.prerequisites.eval()
 
@@ -150,13 +291,15 @@ class Target:
                                                                   evaluated_prerequisites)
 
             if should_run:
-                variables.pollute_environment(self.common_parameters.module_name)
+                environment = variables.environment(self.common_parameters.module_name)
 
                 for cmd in evaluated_cmds:
                     ui.debug("running {!s}".format(cmd))
-                    shell.execute(cmd)
+                    with tracing.span(cmd, "hook"):
+                        shell.execute(cmd, cwd=self.common_parameters.root_path, env=environment)
 
-            os.chdir(root_dir)
+                # there is no way to know what these commands have changed
+                fsutils.stat_cache.clear()
 
 
 class Phony(Target):
@@ -166,7 +309,15 @@ class Phony(Target):
     def type_string(self):
         return "phony"
 
-    def build(self, configuration):
+    def schedule_build(self, scheduler, toolchain, before, dependencies):
+        return scheduler.add(self.common_parameters.name, self.build, [before])
+
+    def ready_job(self, before, done):
+        # phony targets are usually generators, so whatever depends
+        # on them, has to wait for all of their work
+        return done
+
+    def build(self):
         evaluated_artefacts = self.common_parameters.artefacts.eval()
         evaluated_prerequisites = self.common_parameters.prerequisites.eval()
 
@@ -185,61 +336,173 @@ class CompileableTarget(Target):
 
         self.common_parameters = common_parameters
         self.cxx_parameters = cxx_parameters
-        self.error = False
 
-    def _build_object(self, sem, toolchain, name, object_file,
-                       source, include_dirs, compiler_flags):
+    def _build_object(self, build, name, object_file,
+                       source, include_dirs, compiler_flags, *args):
+        """ build is one of toolchain's functions making objects, after
+            first failure, scheduler doesn't start the ones which are
+            left, so targets don't have to remember anything about it
+            (they live as long as --watch or --server does) """
         try:
-            if self.error:
-                return
-
-            with sem:
-                toolchain.build_object(name, object_file, source, include_dirs, compiler_flags)
+            build(name, object_file, source, include_dirs,
+                  compiler_flags, self.common_parameters.root_path, *args)
         except Exception as e:
             ui.debug("catched during compilation {!s}".format(e))
-            self.error_reason = str(e)
-            self.error = True
+            raise
+
+    def _precompiled_header(self):
+        """ header given in precompiled_header or None """
+        evaluated_precompiled_header = self.cxx_parameters.precompiled_header.eval()
+
+        if len(evaluated_precompiled_header) > 1:
+            ui.fatal("target {} can have only one precompiled header, not {!s}"
+                     .format(self.common_parameters.name, evaluated_precompiled_header))
+
+        return evaluated_precompiled_header[0] if evaluated_precompiled_header else None
+
+    def _unity_batch_size(self):
+        """ how many sources are compiled together, 0 or 1 if none """
+        evaluated_unity_build = self.cxx_parameters.unity_build.eval()
+
+        if evaluated_unity_build:
+            value = " ".join(evaluated_unity_build)
+        else:
+            value = configurations.unity_build()
+
+        if not value.isdigit():
+            ui.fatal("unity_build of {} has to be a number of sources compiled together, not {}"
+                     .format(self.common_parameters.name, value))
+
+        return int(value)
+
+    def _isolated_sources(self, toolchain, unity_source, batch):
+        """ sources changed since their batch was built, they are compiled
+            on their own (until most of the batch is), so editing one file
+            doesn't compile whole batch again and again """
+        entry = toolchain.database.get(unity_source) or {}
+        isolated = set(entry.get("isolated", [])) & set(batch)
+        unity_object = unity_source + ".o"
+
+        if fsutils.is_file(unity_object):
+            isolated.update(source for source in batch
+                            if fsutils.is_newer_than(self.path(source), unity_object))
 
-    def build_objects(self, toolchain):
+        if len(isolated) * 2 > len(batch):
+            isolated = set()
+
+        toolchain.database.update(unity_source, isolated=sorted(isolated))
+        return isolated
+
+    def _units(self, toolchain, sources):
+        """ returns (unity source or None, sources) tuples, each of them
+            is compiled into one object """
+        batch_size = self._unity_batch_size()
+
+        if batch_size < 2:
+            return [(None, [source]) for source in sources]
+
+        units = []
+        for index, first in enumerate(range(0, len(sources), batch_size)):
+            batch = sources[first:first + batch_size]
+            unity_source = toolchain.unity_source_filename(self.common_parameters.name, index + 1)
+            isolated = self._isolated_sources(toolchain, unity_source, batch)
+            rest = [source for source in batch if source not in isolated]
+
+            if len(rest) > 1:
+                units.append((unity_source, rest))
+                units.extend((None, [source]) for source in batch if source in isolated)
+            else:
+                units.extend((None, [source]) for source in batch)
+
+        return units
+
+    def schedule_objects(self, scheduler, toolchain, before):
+        """ returns object files and jobs which are making them """
         object_files = []
+        jobs = []
         evaluated_sources = self.cxx_parameters.sources.eval()
         evaluated_include_dirs = self.cxx_parameters.include_dirs.eval()
         evaluated_compiler_flags = self.cxx_parameters.compiler_flags.eval()
+        header = self._precompiled_header()
+
+        ui.debug("scheduling objects from {!s}".format(evaluated_sources))
+
+        precompiled_header = None
+        objects_wait_for = [before]
 
-        ui.debug("building objects from {!s}".format(evaluated_sources))
-        ui.push()
+        if header is not None:
+            precompiled_header = toolchain.precompiled_header_filename(self.common_parameters.name,
+                                                                       header)
 
-        threads = []
+            def build_precompiled_header():
+                self._build_object(toolchain.build_precompiled_header,
+                                   self.common_parameters.name, precompiled_header,
+                                   header, evaluated_include_dirs, evaluated_compiler_flags)
 
-        jobs = command_line.args.jobs
-        limit_semaphore = threading.Semaphore(int(jobs))
-        ui.debug("limiting jobs to {!s}".format(jobs))
+            objects_wait_for = [scheduler.add(self.common_parameters.name + ": " + header,
+                                              build_precompiled_header, [before])]
+
+        for unity_source, sources in self._units(toolchain, evaluated_sources):
+            if unity_source is None:
+                source = sources[0]
+                object_file = toolchain.object_filename(self.common_parameters.name, source)
+            else:
+                source = os.path.basename(unity_source)
+                object_file = unity_source + ".o"
 
-        for source in evaluated_sources:
-            object_file = toolchain.object_filename(self.common_parameters.name,
-                                                        source)
             object_files.append(object_file)
 
-            thread = threading.Thread(target=self._build_object,
-                                      args=(limit_semaphore, toolchain, self.common_parameters.name, object_file,
-                                            source, evaluated_include_dirs, evaluated_compiler_flags))
+            def build_object(object_file=object_file, unity_source=unity_source, sources=sources):
+                if unity_source is not None:
+                    fsutils.write_if_changed(unity_source,
+                                             "".join('#include "{}"\n'.format(self.path(source))
+                                                     for source in sources))
+
+                self._build_object(toolchain.build_object, self.common_parameters.name,
+                                   object_file, unity_source or sources[0],
+                                   evaluated_include_dirs, evaluated_compiler_flags,
+                                   precompiled_header)
+
+            jobs.append(scheduler.add(self.common_parameters.name + ": " + source,
+                                      build_object, objects_wait_for))
 
-            threads.append(thread)
-            thread.daemon = True
-            thread.start()
+        return object_files, jobs
 
-        assert len(threads) <= jobs
+    def watched_files(self, toolchain, build_database):
+        files = Target.watched_files(self, toolchain, build_database)
+        evaluated_sources = self.cxx_parameters.sources.eval()
+        object_files = [toolchain.object_filename(self.common_parameters.name, source)
+                        for source in evaluated_sources]
+        files.extend(self.path(source) for source in evaluated_sources)
+
+        header = self._precompiled_header()
+        if header is not None:
+            files.append(self.path(header))
+            object_files.append(toolchain.precompiled_header_filename(
+                self.common_parameters.name, header) + ".gch")
+
+        batch_size = self._unity_batch_size()
+        if batch_size > 1:
+            for index in range((len(evaluated_sources) + batch_size - 1) // batch_size):
+                object_files.append(toolchain.unity_source_filename(self.common_parameters.name,
+                                                                    index + 1) + ".o")
 
-        for t in threads:
-            t.join()
+        for object_file in object_files:
+            entry = build_database.get(object_file)
+            if entry is not None:
+                files.extend(entry.get("includes", []))
 
-        if self.error:
-            ui.fatal("failed building {!s}: {!s}"
-                     .format(self.common_parameters.name, self.error_reason))
+        return files
 
-        ui.pop()
+    def schedule_build(self, scheduler, toolchain, before, dependencies):
+        object_files, jobs = self.schedule_objects(scheduler, toolchain, before)
 
-        return object_files
+        # linking needs also libraries which we are linking with
+        jobs.extend(dependency.done for dependency in dependencies)
+        jobs.append(before)
+
+        return scheduler.add(self.common_parameters.name,
+                             lambda: self.link(toolchain, object_files), jobs)
 
 
 class Application(CompileableTarget):
@@ -252,16 +515,10 @@ class Application(CompileableTarget):
     def type_string(self):
         return "application"
 
-    def build(self, toolchain):
-        root_dir = os.getcwd()
-        os.chdir(self.common_parameters.root_path)
-
-        object_files = self.build_objects(toolchain)
-
+    def link(self, toolchain, object_files):
         toolchain.link_application(toolchain.application_filename(self.common_parameters.name),
-                                   object_files, self.link_with.eval(), self.library_dirs.eval())
-
-        os.chdir(root_dir)
+                                   object_files, self.link_with.eval(), self.library_dirs.eval(),
+                                   self.common_parameters.root_path)
 
 
 class StaticLibrary(CompileableTarget):
@@ -271,17 +528,6 @@ class StaticLibrary(CompileableTarget):
     def type_string(self):
         return "static_library"
 
-    def build(self, toolchain):
-        root_dir = os.getcwd()
-        os.chdir(self.common_parameters.root_path)
-
-        object_files = self.build_objects(toolchain)
-
-        artefact = toolchain.static_library_filename(self.common_parameters.name)
-
-        if fsutils.is_any_newer_than(object_files, artefact):
-            toolchain.link_static_library(artefact, object_files)
-        else:
-            ui.bigstep("up to date", artefact)
-
-        os.chdir(root_dir)
+    def link(self, toolchain, object_files):
+        toolchain.link_static_library(toolchain.static_library_filename(self.common_parameters.name),
+                                      object_files, self.common_parameters.root_path)
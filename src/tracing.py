@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+import ui
+
+# nothing is recorded unless --trace is given, not to slow down
+# every build (and not to grow forever in --watch)
+enabled = False
+
+_lock = threading.Lock()
+_events = []
+_thread_ids = {}
+_critical_path = []
+_epoch = time.time()
+
+
+def reset(enable):
+    global enabled, _critical_path
+
+    with _lock:
+        enabled = enable
+        del _events[:]
+        _critical_path = []
+
+
+def _thread_id():
+    """ small number of the thread, to be shown instead of its ident """
+    thread = threading.current_thread()
+
+    if thread.ident not in _thread_ids:
+        _thread_ids[thread.ident] = (len(_thread_ids), thread.name)
+
+    return _thread_ids[thread.ident][0]
+
+
+def add(name, category, started, duration):
+    """ name can be anything printable, it's turned into string only
+        when tracing is enabled """
+    if not enabled:
+        return
+
+    with _lock:
+        _events.append({"name": str(name),
+                        "cat": category,
+                        "ph": "X",
+                        "ts": int((started - _epoch) * 1000000),
+                        "dur": int(duration * 1000000),
+                        "pid": os.getpid(),
+                        "tid": _thread_id()})
+
+
+class _NoSpan:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_no_span = _NoSpan()
+
+
+@contextlib.contextmanager
+def _span(name, category):
+    started = time.time()
+    try:
+        yield
+    finally:
+        add(name, category, started, time.time() - started)
+
+
+def span(name, category):
+    """ everything done inside is recorded as one event """
+    if not enabled:
+        return _no_span
+
+    return _span(name, category)
+
+
+def set_critical_path(jobs):
+    """ jobs are (name, duration) tuples """
+    global _critical_path
+
+    with _lock:
+        _critical_path = list(jobs)
+
+
+def save(filename):
+    """ writes Chrome trace-event JSON (for chrome://tracing or Perfetto) """
+    with _lock:
+        names = [{"name": "thread_name",
+                  "ph": "M",
+                  "pid": os.getpid(),
+                  "tid": tid,
+                  "args": {"name": name}} for tid, name in _thread_ids.values()]
+
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": names + _events}, f)
+
+
+def _print_summary_of(title, events):
+    ui.info(ui.BOLD + title + ui.RESET)
+
+    for name, duration in events:
+        ui.info("  {:>9.3f}s  {}".format(duration, name))
+
+
+def print_summary(slowest_count=10):
+    with _lock:
+        compilations = [(event["name"], event["dur"] / 1000000.0)
+                        for event in _events if event["cat"] == "compile"]
+        critical_path = list(_critical_path)
+
+    if critical_path:
+        _print_summary_of("critical path ({:.3f}s):".format(sum(d for _, d in critical_path)),
+                          critical_path)
+
+    if compilations:
+        slowest = sorted(compilations, key=lambda event: event[1], reverse=True)[:slowest_count]
+        _print_summary_of("slowest translation units:", slowest)
@@ -1,15 +1,20 @@
 import os
 import sys
+import Queue
+import atexit
+import shutil
 import threading
 
+_IS_A_TTY = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
+
+
 def _supports_color():
     # function taken from Django
     plat = sys.platform
     supported_platform = plat != 'Pocket PC' and (plat != 'win32' or
                                                   'ANSICON' in os.environ)
-    is_a_tty = hasattr(sys.stdout, 'isatty') and sys.stdout.isatty()
 
-    return supported_platform and is_a_tty
+    return supported_platform and _IS_A_TTY
 
 
 if _supports_color():
@@ -34,6 +39,54 @@ _log_depth = 0
 _lock = threading.Lock()
 
 
+class _Writer:
+    """ everything is written by one thread, so nobody waits for the
+        terminal, streams are flushed when there is nothing more to write """
+
+    def __init__(self):
+        self.__queue = Queue.Queue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def write(self, stream, data):
+        """ data is either a string or a file which is closed afterwards """
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+
+        self.__queue.put((stream, data))
+
+    def flush(self):
+        self.__queue.join()
+
+    def __run(self):
+        while True:
+            stream, data = self.__queue.get()
+
+            try:
+                if isinstance(data, basestring):
+                    stream.write(data)
+                else:
+                    shutil.copyfileobj(data, stream)
+                    data.close()
+
+                if self.__queue.empty():
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+            except IOError:
+                pass
+            finally:
+                self.__queue.task_done()
+
+
+_writer = _Writer()
+
+# whatever is still in the queue has to be written before pake exits
+atexit.register(_writer.flush)
+
+
 class _Ident:
     def __enter__(self):
         global _log_depth
@@ -50,12 +103,10 @@ ident = _Ident()
 
 
 def _fancy_print(base_text, color="", additional_text=""):
-    with _lock:
-        if sys.stdout.isatty():
-            print("{}{}{} {}".format(color, base_text, RESET, additional_text))
-        else:
-            print("{} {}".format(base_text, additional_text))
-        sys.stdout.flush()
+    if _IS_A_TTY:
+        _writer.write(sys.stdout, "{}{}{} {}\n".format(color, base_text, RESET, additional_text))
+    else:
+        _writer.write(sys.stdout, "{} {}\n".format(base_text, additional_text))
 
 
 def push():
@@ -72,17 +123,21 @@ def pop():
         _log_depth -= 1
 
 
-def print_depth_prefix():
-    global _log_depth
-
-    for i in range(_log_depth):
-        sys.stdout.write("    ")
+def _depth_prefix():
+    return "    " * _log_depth
 
 
 def info(message):
-    with _lock:
-        print(message)
-        sys.stdout.flush()
+    _writer.write(sys.stdout, message + "\n")
+
+
+def output(data, error=False):
+    """ output of the tools pake runs, data is a string or a file """
+    _writer.write(sys.stderr if error else sys.stdout, data)
+
+
+def flush():
+    _writer.flush()
 
 
 def step(tool, parameter):
@@ -99,6 +154,7 @@ def warning(message):
 
 def fatal(message):
     _fancy_print("fatal:", BOLD_RED, message)
+    _writer.flush()
     sys.exit(1)
 
 
@@ -118,6 +174,4 @@ def parse_error(token=None, msg=None, location=None):
 
 def debug(s):
     if "DEBUG" in os.environ:
-        with _lock:
-            print_depth_prefix()
-            print(GRAY + s + RESET)
+        _writer.write(sys.stdout, _depth_prefix() + GRAY + s + RESET + "\n")
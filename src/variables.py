@@ -1,12 +1,63 @@
 import os
+import re
+import copy
+import threading
 
 import ui
 import fsutils
+import tracing
 import collections
 from fsutils import flatten_list
 
 modules = collections.defaultdict(dict)
 
+_PLACEHOLDER = re.compile(r"\$(?:\{([^}]*)(\})?)?")
+
+# evaluated values are cached in variables, every variable remembers
+# which named variables it used, so it can be evaluated again when
+# one of them is changed by add or append
+_dependants = collections.defaultdict(set)
+_evaluation_stack = []
+_evaluation_lock = threading.RLock()
+
+# environments of modules, None is the one with variables of all modules
+_environments = {}
+
+
+def reset():
+    """ forgets all modules, so they can be parsed again """
+    with _evaluation_lock:
+        modules.clear()
+        _dependants.clear()
+        _environments.clear()
+
+
+def forget_environments():
+    """ os.environ they are made of can change as well (server takes
+        it from every client) """
+    with _evaluation_lock:
+        _environments.clear()
+
+
+def _depend_on(keys):
+    for variable in _evaluation_stack:
+        for key in keys:
+            _dependants[key].add(variable)
+            variable._references.add(key)
+
+
+def _invalidate(module_name, name):
+    with _evaluation_lock:
+        for variable in _dependants.pop((module_name, name), ()):
+            variable._value = None
+
+        _environments.clear()
+
+
+def _format_cycle(variables):
+    return " -> ".join("${}.{}".format(variable.module, variable.name[1:])
+                       for variable in variables if variable.name is not None)
+
 
 def export_special_variables(configuration):
     ui.debug("exporting special variables")
@@ -23,20 +74,42 @@ def export_special_variables(configuration):
             add(module, "$__build", fsutils.build_dir(configuration.name))
 
 
-def pollute_environment(current_module):
-    ui.debug("polluting environment")
+def _environment_name(module, name):
+    return module + "_" + name[1:]
+
+
+def _variables_environment():
+    ui.debug("exporting variables to environment")
+
+    environment = dict(os.environ)
 
     with ui.ident:
         for module in modules:
             for (name, variable) in modules[module].iteritems():
-                evaluated = variable.eval()
-                env_name = module + "_" + name[1:]
-                os.environ[env_name] = " ".join(evaluated)
-                ui.debug("  " + env_name + ": " + str(evaluated))
-                if module == current_module:
-                    env_short_name = name[1:]
-                    os.environ[env_short_name] = " ".join(evaluated)
-                    ui.debug("  " + env_short_name + ": " + str(evaluated))
+                evaluated = " ".join(variable.eval())
+                environment[_environment_name(module, name)] = evaluated
+                ui.debug("  {}: {}".format(_environment_name(module, name), evaluated))
+
+    return environment
+
+
+def environment(current_module):
+    """ environment for commands run by targets of current_module, it
+        has all variables as module_name, and variables of current_module
+        also as just name, it's made once (until some variable changes)
+        and shared, so it must not be modified """
+    with _evaluation_lock:
+        if current_module not in _environments:
+            if None not in _environments:
+                _environments[None] = _variables_environment()
+
+            module_environment = dict(_environments[None])
+            for (name, variable) in modules[current_module].iteritems():
+                module_environment[name[1:]] = " ".join(variable.eval())
+
+            _environments[current_module] = module_environment
+
+        return _environments[current_module]
 
 
 def make_simple_variable(value):
@@ -48,61 +121,67 @@ def eval_variable_to_string(variable):
 
 
 class Literal:
-    def __init__(self, module, content):
+    """ quoted string, its ${...} placeholders are found once, when it's
+        created, so evaluating it is only a matter of joining segments """
+
+    def __init__(self, module, content, location=None):
         self.module = module
         self.content = content
+        self.segments = self.__compile(location)
 
     def __str__(self):
         return self.content
 
     __repr__ = __str__
 
+    def __error(self, location, position, msg):
+        if location is not None:
+            location = copy.copy(location)
+            location.line += self.content.count("\n", 0, position)
+
+        ui.parse_error(location=location, msg=msg)
+
+    def __compile(self, location):
+        segments = []
+        position = 0
+
+        for m in _PLACEHOLDER.finditer(self.content):
+            if m.start() > position:
+                segments.append(self.content[position:m.start()])
+
+            name, closing = m.groups()
+
+            if name is None:
+                self.__error(location, m.start(), "expecting { after $")
+            elif closing is None:
+                self.__error(location, m.start(), "expecting } after ${" + name)
+            elif not name:
+                self.__error(location, m.start(), "empty variable name in ${}")
+
+            segments.append(ReferenceToVariable(self.module, "$" + name))
+            position = m.end()
+
+        if position < len(self.content):
+            segments.append(self.content[position:])
+
+        return segments
+
     def eval(self):
-        ui.debug("evaluating {!s}: ".format(self))
-
-        s = self.content
-
-        ret = []
-
-        STATE_READING = 1
-        STATE_WAITING_FOR_PARENTHESIS = 2
-        STATE_READING_NAME = 3
-
-        variable_name = '$'
-        state = STATE_READING
-
-        for c in s:
-            if state == STATE_READING:
-                if c == "$":
-                    state = STATE_WAITING_FOR_PARENTHESIS
-                else:
-                    ret.append(c)
-            elif state == STATE_WAITING_FOR_PARENTHESIS:
-                if c == "{":
-                    state = STATE_READING_NAME
-                else:
-                    ui.parse_error(msg="expecting { after $")
-            elif state == STATE_READING_NAME:
-                if c == "}":
-                    ui.debug("variable: " + variable_name)
-
-                    variable = ReferenceToVariable(self.module, variable_name)
-                    ret.append(" ".join(variable.eval()))
-
-                    variable_name = '$'
-                    state = STATE_READING
-                else:
-                    variable_name += c
-            elif state == STATE_READING_NAME:
-                variable_name = variable_name + c
-
-        return ["".join(ret)]
+        return ["".join(segment if isinstance(segment, str) else " ".join(segment.eval())
+                        for segment in self.segments)]
 
     eval_to_string = eval_variable_to_string
 
 
 class ReferenceToVariable:
     def __init__(self, module, name):
+        parts = name.split(".")
+
+        # $module.name refers to other module
+        if len(parts) == 2:
+            module = parts[0][1:]  # lose the $
+            name = "$" + parts[1]
+
         self.module = module
         self.name = name
 
@@ -114,15 +193,6 @@ class ReferenceToVariable:
     def eval(self):
         ui.debug("evaluating {!s}".format(self))
 
-        parts = self.name.split(".")
-
-        if len(parts) == 1:
-            self.module = self.module
-            self.name = parts[0]
-        elif len(parts) == 2:
-            self.module = parts[0][1:]  # lose the $
-            self.name = "$" + parts[1]
-
         global modules
 
         if self.module not in modules:
@@ -131,17 +201,28 @@ class ReferenceToVariable:
         if self.name not in modules[self.module]:
             ui.fatal("{!s} does not exist".format(self))
 
-        return modules[self.module][self.name].eval()
+        with _evaluation_lock:
+            _depend_on([(self.module, self.name)])
+            return modules[self.module][self.name].eval()
 
     eval_to_string = eval_variable_to_string
 
 
 class Variable:
+    _value = None
+    _references = ()
+
     def __init__(self, module=None, name=None, content=None):
         self.module = module
         self.name = name
         self.content = [content] if content else []
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_value", None)
+        state.pop("_references", None)
+        return state
+
     def __str__(self):
         if self.module is not None or self.name is not None:
             return "${}.{} = {!s} ".format(self.module, self.name, self.content)
@@ -151,8 +232,33 @@ class Variable:
     def __nonzero__(self):
         return 1 if self.module is not None or self.name is not None or self.content else 0
 
-    @flatten_list
     def eval(self):
+        with _evaluation_lock:
+            if self._value is None:
+                self.__evaluate()
+            else:
+                _depend_on(self._references)
+
+            return list(self._value)
+
+    def __evaluate(self):
+        if self in _evaluation_stack:
+            cycle = _evaluation_stack[_evaluation_stack.index(self):] + [self]
+            ui.fatal("circular reference: " + _format_cycle(cycle))
+
+        self._references = set()
+
+        _evaluation_stack.append(self)
+        try:
+            with tracing.span(self, "evaluation"):
+                value = self.__evaluate_content()
+        finally:
+            _evaluation_stack.pop()
+
+        self._value = value
+
+    @flatten_list
+    def __evaluate_content(self):
         def eval_not_str(e):
             return [e] if isinstance(e, str) else e.eval()
 
@@ -162,6 +268,8 @@ class Variable:
 
 
 def add_empty(module_name, name):
+    _invalidate(module_name, name)
+
     variable = Variable(name=name)
     modules[module_name][name] = variable
 
@@ -169,6 +277,8 @@ def add_empty(module_name, name):
 
 
 def add(module_name, name, value):
+    _invalidate(module_name, name)
+
     variable = Variable(module_name, name, value)
     modules[module_name][name] = variable
 
@@ -179,7 +289,10 @@ def append(module_name, name, value):
     if name not in modules[module_name]:
         modules[module_name][name] = Variable(module_name, name)
 
+    _invalidate(module_name, name)
+
     variable = modules[module_name][name]
     variable.content.append(value)
+    variable._value = None
 
     ui.debug("setting variable: {!s}".format(variable))
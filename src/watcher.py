@@ -0,0 +1,156 @@
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+
+import ui
+
+# from sys/inotify.h
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_CLOEXEC = 0o2000000
+
+_MASK = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+_EVENT = struct.Struct("iIII")
+
+# changes usually come in bursts (e.g. editor saving few files)
+_QUIET_PERIOD = 0.1
+
+
+def _is_pake_file(filename):
+    return filename.endswith(".pake")
+
+
+class Inotify:
+    """ waits for changes of given files, only their directories are
+        watched, because editors often replace files instead of writing
+        to them, watch() has to be called before wait(), changes made
+        in between are not missed """
+
+    def __init__(self, libc):
+        self.__libc = libc
+        self.__fd = libc.inotify_init1(_IN_CLOEXEC)
+
+        # one directory can be spelled in many ways (e.g. through
+        # a symlink), inotify gives the same wd for all of them
+        self.__directories = {}
+        self.__watched = {}
+
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def __watch(self, directory):
+        real_directory = os.path.realpath(directory)
+        wd = self.__watched.get(real_directory)
+
+        if wd is None:
+            wd = self.__libc.inotify_add_watch(self.__fd, real_directory, _MASK)
+
+            if wd < 0:
+                ui.debug("can't watch {}: {}".format(directory, os.strerror(ctypes.get_errno())))
+                return
+
+            self.__watched[real_directory] = wd
+
+        self.__directories.setdefault(wd, set()).add(directory)
+
+    def __read_events(self):
+        data = os.read(self.__fd, 65536)
+        position = 0
+
+        while position < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, position)
+            position += _EVENT.size
+            name = data[position:position + length].rstrip("\0")
+            position += length
+
+            if mask & _IN_Q_OVERFLOW:
+                yield None
+            else:
+                for directory in self.__directories.get(wd, ()):
+                    yield os.path.join(directory, name)
+
+    def __select(self, timeout):
+        try:
+            return select.select([self.__fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+
+    def watch(self, filenames):
+        for directory in set(os.path.dirname(filename) for filename in filenames):
+            self.__watch(directory)
+
+    def wait(self, filenames):
+        """ returns these of filenames (or new pake modules) which changed """
+        filenames = set(filenames)
+        changed = set()
+
+        while True:
+            # after first change, few more are collected
+            timeout = _QUIET_PERIOD if changed else None
+
+            if not self.__select(timeout):
+                if changed:
+                    return changed
+                continue
+
+            for filename in self.__read_events():
+                if filename is None:
+                    ui.debug("too many changes, assuming everything changed")
+                    changed.update(filenames)
+                elif filename in filenames or _is_pake_file(filename):
+                    ui.debug("found change: {}".format(filename))
+                    changed.add(filename)
+
+
+class Polling:
+    """ checks given files every second, used where inotify isn't there,
+        files are compared with what they were when watch() was called """
+
+    def __init__(self):
+        self.__known = {}
+
+    def __stats(self, filenames):
+        stats = {}
+        for filename in filenames:
+            try:
+                st = os.stat(filename)
+                stats[filename] = (st.st_mtime, st.st_size)
+            except OSError:
+                stats[filename] = None
+        return stats
+
+    def watch(self, filenames):
+        self.__known = self.__stats(filenames)
+
+    def wait(self, filenames):
+        while True:
+            time.sleep(1)
+
+            current = self.__stats(filenames)
+            changed = set(filename for filename in filenames
+                          if current[filename] != self.__known.get(filename))
+
+            if changed:
+                ui.debug("found changes: {!s}".format(sorted(changed)))
+                return changed
+
+
+def create():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1
+        return Inotify(libc)
+    except (AttributeError, OSError) as e:
+        ui.debug("inotify is not available ({!s}), polling for changes".format(e))
+        return Polling()
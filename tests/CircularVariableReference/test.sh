@@ -0,0 +1,8 @@
+. ../common.sh
+
+rm -rf __build
+
+assert_fail $pake hello
+assert test ! -f __build/__default/hello
+
+rm -rf __build
@@ -0,0 +1,26 @@
+. ../common.sh
+
+rm -rf __build
+cp utils.hpp utils.hpp.orig
+
+assert $pake hello
+assert __build/__default/hello
+
+big_echo "touching files without changing them doesn't rebuild anything"
+rm __build/calls.list
+assert touch main.cpp foo.cpp foo.hpp utils.hpp
+assert $pake hello
+assert_fail grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert_fail grep -e -c.*foo __build/calls.list > /dev/null
+assert_fail grep -e -o.*hello __build/calls.list > /dev/null
+
+big_echo "but changing them does"
+echo "// changed" >> utils.hpp
+assert $pake hello
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert_fail grep -e -c.*foo __build/calls.list > /dev/null
+assert grep -e -o.*hello __build/calls.list > /dev/null
+assert __build/__default/hello
+
+mv utils.hpp.orig utils.hpp
+rm -rf __build
@@ -0,0 +1,5 @@
+#include "foo.hpp"
+
+void foo()
+{
+}
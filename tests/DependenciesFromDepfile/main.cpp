@@ -0,0 +1,6 @@
+#include "utils.hpp"
+#include "foo.hpp"
+
+int main()
+{
+}
@@ -0,0 +1,28 @@
+. ../common.sh
+
+rm -rf __build
+
+assert $pake hello
+assert __build/__default/hello
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert grep -e -c.*foo __build/calls.list > /dev/null
+assert_fail grep -e -M[^DF] __build/calls.list > /dev/null
+
+rm __build/calls.list
+assert $pake hello
+assert_fail test -f __build/calls.list
+
+assert touch utils.hpp
+assert $pake hello
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert_fail grep -e -c.*foo __build/calls.list > /dev/null
+assert grep -e -o.*hello __build/calls.list > /dev/null
+
+rm __build/calls.list
+assert touch foo.hpp
+assert $pake hello
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert grep -e -c.*foo __build/calls.list > /dev/null
+assert_fail grep -e -M[^DF] __build/calls.list > /dev/null
+
+rm -rf __build
@@ -0,0 +1,46 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    mkdir -p app .git/hooks third_party/zlib examples/old
+    echo "int main() {}" > app/main.cpp
+    echo 'target application app sources(main.cpp)' > app/app.pake
+
+    # any of these would break the build if it was parsed
+    echo 'broken' > .git/hooks/broken.pake
+    echo 'broken' > third_party/zlib/broken.pake
+    echo 'broken' > examples/old/broken.pake
+    echo 'broken' > examples/broken.pake
+
+    big_echo "ignored directories and modules are not parsed"
+    echo "# vendored code" > .pakeignore
+    echo "third_party" >> .pakeignore
+    echo "/examples/old/" >> .pakeignore
+    echo "examples/*.pake" >> .pakeignore
+
+    assert $pake app
+    assert test -f __build/__default/app
+
+    big_echo "directories which didn't change are not listed again"
+    touch -d "1 hour ago" . app .git .git/hooks third_party third_party/zlib examples examples/old
+    assert $pake app
+    DEBUG=1 $pake app > __build/output.log 2>&1
+    assert grep -q "found.1.pake.files.in.3.directories,.0.of.them.listed" __build/output.log
+
+    big_echo "new module in a known directory is found"
+    echo "int main() {}" > app/other.cpp
+    echo 'target application other sources(other.cpp)' > app/other.pake
+    assert $pake other
+    assert test -f __build/__default/other
+
+    big_echo "changing .pakeignore makes ignored modules visible again"
+    echo "third_party" > .pakeignore
+    echo "/examples/old" >> .pakeignore
+    assert_fail $pake app
+
+popd > /dev/null
+
+rm -rf __build
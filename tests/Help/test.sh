@@ -0,0 +1,28 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int main() {}" > main.cpp
+    echo 'target application app sources(main.cpp)' > app.pake
+    echo 'broken' > broken.pake
+
+    big_echo "--help doesn't look for or parse any module"
+    assert $pake --help
+    assert test ! -e __build
+
+    big_echo "wrong arguments are reported before parsing modules"
+    $pake --no-such-option > output.log 2>&1
+    assert test $? -eq 2
+    assert grep -q "unrecognized.arguments" output.log
+    assert test ! -e __build
+
+    big_echo "modules are parsed when something is to be done"
+    $pake app > output.log 2>&1
+    assert grep -q "broken.pake:1:.expected.directive" output.log
+
+popd > /dev/null
+
+rm -rf __build
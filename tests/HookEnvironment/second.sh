@@ -0,0 +1,2 @@
+#!/bin/sh
+echo $greeting $first_greeting > __build/second.txt
@@ -0,0 +1,15 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build
+
+    big_echo "hooks running in parallel get variables of their own modules"
+    assert $pake -j8 first second
+    assert grep -q ^hello_from_first$ __build/first.txt
+    assert grep -q "^hello_from_second.hello_from_first$" __build/second.txt
+
+    big_echo "variables of other modules are there when only one target is built"
+    assert $pake second
+    assert grep -q "^hello_from_second.hello_from_first$" __build/second.txt
+
+rm -rf __build
@@ -0,0 +1,42 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int lib() { return FLAG; }" > lib.cpp
+    echo "int lib(); int main() { return lib(); }" > hello.cpp
+    echo "int main() {}" > other.cpp
+
+    echo 'target static_library lib sources(lib.cpp) compiler_flags($flags.cflags)' > lib.pake
+    echo 'target application hello sources(hello.cpp) depends_on(lib) link_with(lib)' > hello.pake
+    echo 'set $cflags -DFLAG=0' > flags.pake
+    echo 'target application other sources(other.cpp)' > other.pake
+    echo 'configuration release compiler_flags(-O2)' > release.pake
+
+    assert $pake hello
+    assert test -f __build/modules.index
+
+    big_echo "only modules of the target, its dependencies and variables are parsed"
+    DEBUG=1 $pake hello > debug.log
+    assert grep -q "parsing.3.of.5.modules" debug.log
+    assert __build/__default/hello
+
+    big_echo "module with selected configuration is parsed as well"
+    DEBUG=1 $pake hello -c release > debug.log
+    assert grep -q "parsing.4.of.5.modules" debug.log
+    assert __build/release/hello
+
+    big_echo "everything is parsed again when any module changes"
+    echo 'set $cflags -DFLAG=1' > flags.pake
+    DEBUG=1 $pake hello > debug.log
+    assert grep -q "module.index.is.out.of.date" debug.log
+    assert_fail __build/__default/hello
+
+    big_echo "unknown target is reported like before"
+    assert_fail $pake unknown
+
+popd > /dev/null
+
+rm -rf __build
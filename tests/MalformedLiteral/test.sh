@@ -0,0 +1,11 @@
+. ../common.sh
+
+rm -rf __build
+
+assert_fail $pake hello
+
+big_echo "error points to the literal"
+$pake hello > error.log 2>&1
+assert grep -q "hello.pake:3:.expecting.{.after.\\$" error.log
+
+rm -rf __build error.log
@@ -13,11 +13,44 @@ for i in {1..50}; do
 done
 
 echo "target application hello sources(main.cpp \$sources)" >> hello.pake
+echo "target application unity sources(main.cpp \$sources) unity_build(20)" >> hello.pake
+echo "configuration unity unity_build(10)" >> hello.pake
 
 assert $pake -j5 hello
 assert __build/__default/hello
 
+big_echo "unity build compiles sources in batches"
+$pake -j5 unity > output.log 2>&1
+assert __build/__default/unity
+assert test `grep -c "^c++" output.log` -eq 3
+assert test -f __build/__default/build.unity/unity_3.cpp.o
+assert_fail test -f __build/__default/build.unity/unity_4.cpp.o
+
+big_echo "changed source is compiled on its own"
+sleep 1
+echo "void func_7() { }" > src/func_7.cpp
+$pake -j5 unity > output.log 2>&1
+assert grep -q "^c++.src/func_7.cpp" output.log
+assert grep -q "^c++.*unity_1.cpp" output.log
+assert __build/__default/unity
+
+sleep 1
+echo "void func_7() {  }" > src/func_7.cpp
+$pake -j5 unity > output.log 2>&1
+assert test `grep -c "^c++" output.log` -eq 1
+assert grep -q "^c++.src/func_7.cpp" output.log
+assert __build/__default/unity
+
+big_echo "nothing is built when nothing changed"
+$pake -j5 unity > output.log 2>&1
+assert_fail grep -q "^c++" output.log
+
+big_echo "batch size might come from the configuration"
+$pake -j5 -c unity hello > output.log 2>&1
+assert __build/unity/hello
+assert test `grep -c "^c++" output.log` -eq 6
+
+rm -f output.log
 rm -f hello.pake
 rm -rf src
 rm -rf __build
-
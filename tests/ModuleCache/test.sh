@@ -0,0 +1,32 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int main() {}" > hello.cpp
+    echo 'set $sources hello.cpp' > hello.pake
+    echo 'target application hello sources($sources)' >> hello.pake
+
+    assert $pake hello
+    assert test -f __build/modules.cache
+
+    big_echo "cached module is used when nothing changed"
+    assert $pake hello
+    assert __build/__default/hello
+
+    big_echo "changed module is parsed again"
+    echo 'target application hello_again sources($sources)' >> hello.pake
+    assert $pake hello_again
+    assert __build/__default/hello_again
+
+    big_echo "removed module is forgotten"
+    rm hello.pake
+    echo 'target application hello_renamed sources(hello.cpp)' > renamed.pake
+    assert $pake hello_renamed
+    assert_fail $pake hello
+
+popd > /dev/null
+
+rm -rf __build
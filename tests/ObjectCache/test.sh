@@ -0,0 +1,34 @@
+. ../common.sh
+
+rm -rf __build
+
+cache=`pwd`/__build/cache
+
+assert $pake --object-cache $cache hello
+assert __build/__default/hello
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+
+big_echo "other configuration gets objects from the cache"
+rm __build/calls.list
+assert $pake --object-cache $cache -c other hello
+assert __build/other/hello
+assert_fail grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert_fail grep -e -c.*foo.cpp __build/calls.list > /dev/null
+
+big_echo "lines of the source matter when there is debug info"
+assert $pake --object-cache $cache -c debug hello
+cp main.cpp __build/main.cpp.orig
+(echo; cat __build/main.cpp.orig) > main.cpp
+rm __build/calls.list
+assert $pake --object-cache $cache -c debug hello
+mv __build/main.cpp.orig main.cpp
+assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+
+big_echo "objects are not shared when cache is too small"
+rm -rf __build
+mkdir -p __build
+assert $pake --object-cache $cache --object-cache-size 0 hello
+assert __build/__default/hello
+assert_fail ls $cache/*/*.o
+
+rm -rf __build
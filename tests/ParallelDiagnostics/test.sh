@@ -0,0 +1,32 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    for i in `seq 16`; do
+        for j in `seq 20`; do
+            echo "#warning diagnostic_of_unit_${i}_number_${j}"
+        done > unit_$i.cpp
+        echo "append \$sources unit_$i.cpp" >> noisy.pake
+    done
+    echo "int main() {}" > main.cpp
+    echo 'target application noisy sources(main.cpp $sources)' >> noisy.pake
+
+    $pake -j16 noisy > output.log 2>&1
+    assert test -f __build/__default/noisy
+
+    big_echo "diagnostics of each compiler are printed together"
+    for i in `seq 16`; do
+        lines=`grep -n "diagnostic_of_unit_${i}_number_" output.log | cut -d: -f1`
+        first=`echo "$lines" | head -n 1`
+        last=`echo "$lines" | tail -n 1`
+        count=`echo "$lines" | wc -l`
+        assert test $count -ge 20
+        assert test $(($last - $first + 1)) -le $((2 * $count))
+    done
+
+popd > /dev/null
+
+rm -rf __build
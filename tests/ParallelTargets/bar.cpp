@@ -0,0 +1,2 @@
+int baz();
+int bar() { return baz(); }
@@ -0,0 +1 @@
+int baz() { return 2; }
@@ -0,0 +1,17 @@
+for source; do :; done
+
+case " $* " in
+    *" -c "*) compiling=1 ;;
+    *) compiling= ;;
+esac
+
+if [ -n "$compiling" ]; then
+    echo "start $source" >> __build/compilations.log
+    sleep 1
+fi
+
+c++ "$@" || exit $?
+
+if [ -n "$compiling" ]; then
+    echo "end $source" >> __build/compilations.log
+fi
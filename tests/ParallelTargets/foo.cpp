@@ -0,0 +1 @@
+int foo() { return 1; }
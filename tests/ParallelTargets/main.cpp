@@ -0,0 +1,3 @@
+int foo();
+int bar();
+int main() { return foo() + bar() - 3; }
@@ -0,0 +1,30 @@
+. ../common.sh
+
+rm -rf __build
+
+assert $pake -j8 hello
+assert __build/__default/hello
+
+big_echo "everything is up to date so no rebuild"
+assert $pake -j8 -a
+assert __build/__default/hello
+
+big_echo "objects of different targets are compiled at the same time"
+rm -rf __build
+function line_of()
+{
+    grep -n "^$1 .*/$2$" __build/compilations.log | head -n 1 | cut -d: -f1
+}
+assert $pake -j8 -c slow_compiler hello
+assert __build/slow_compiler/hello
+assert test `line_of start foo.cpp` -lt `line_of end baz.cpp`
+assert test `line_of start baz.cpp` -lt `line_of end foo.cpp`
+
+mkdir -p __build/cycle
+pushd __build/cycle > /dev/null
+    echo "target phony cycle_a depends_on(cycle_b)" > cycle.pake
+    echo "target phony cycle_b depends_on(cycle_a)" >> cycle.pake
+    assert_fail $pake -j8 cycle_a
+popd > /dev/null
+
+rm -rf __build
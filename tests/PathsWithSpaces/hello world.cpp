@@ -0,0 +1,3 @@
+#include "value.hpp"
+const char *greeting = GREETING;
+int main() { return VALUE; }
@@ -0,0 +1,15 @@
+. ../common.sh
+
+rm -rf __build
+
+    assert $pake hello
+    assert __build/__default/hello
+
+    big_echo "header in directory with space in its name is tracked"
+    echo '#define VALUE 1' > "my include/value.hpp"
+    $pake hello
+    assert_fail __build/__default/hello
+
+    echo '#define VALUE 0' > "my include/value.hpp"
+
+rm -rf __build
@@ -0,0 +1,56 @@
+. ../common.sh
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    mkdir -p include
+    echo "#include <string>" > include/common.hpp
+    echo "inline int value() { return 1; }" >> include/common.hpp
+
+    echo "int first() { return value(); }" > first.cpp
+    echo "int first(); int main() { return first() + value(); }" > main.cpp
+    echo "int second() { return value(); }" > second.cpp
+
+    # -H shows included headers, precompiled ones are marked with !
+    echo 'target static_library library sources(second.cpp) precompiled_header(include/common.hpp) compiler_flags(-H)' > library.pake
+    echo 'target application app sources(main.cpp first.cpp) precompiled_header(include/common.hpp) compiler_flags(-H) link_with(library) depends_on(library)' > app.pake
+
+    $pake app > output.log 2>&1
+    assert test -f __build/__default/app
+
+    big_echo "header is precompiled once for each target"
+    assert test -f __build/__default/build.app/include/common.hpp.gch
+    assert test -f __build/__default/build.library/include/common.hpp.gch
+    assert test `grep -c "c++.include/common.hpp" output.log` -eq 2
+
+    big_echo "objects use precompiled header"
+    assert test `grep -c "^!.*build.app/include/common.hpp.gch" output.log` -eq 2
+    assert test `grep -c "^!.*build.library/include/common.hpp.gch" output.log` -eq 1
+
+    big_echo "nothing is rebuilt when nothing changed"
+    $pake app > output.log 2>&1
+    assert_fail grep -q "c++" output.log
+
+    big_echo "changing the header rebuilds it and objects using it"
+    echo "inline int value() { return 2; }" > include/common.hpp
+    $pake app > output.log 2>&1
+    assert test `grep -c "c++.include/common.hpp" output.log` -eq 2
+    assert grep -q "c++.main.cpp" output.log
+    assert grep -q "c++.second.cpp" output.log
+    __build/__default/app
+    assert test $? -eq 4
+
+    big_echo "objects depend on precompiled header even if depfile doesn't say so"
+    echo 'configuration depfile dependency_scan(depfile)' >> app.pake
+    assert $pake -c depfile app
+    echo "inline int value() { return 3; }" > include/common.hpp
+    $pake -c depfile app > output.log 2>&1
+    assert grep -q "c++.main.cpp" output.log
+    __build/depfile/app
+    assert test $? -eq 6
+
+popd > /dev/null
+
+rm -rf __build
@@ -7,6 +7,7 @@ assert grep -e -c.*main.cpp __build/calls.list > /dev/null
 assert grep -e -c.*foo __build/calls.list > /dev/null
 assert grep -e -o.*hello __build/calls.list > /dev/null
 assert __build/__default/hello
+assert test -f __build/__default/pake.db
 
 rm __build/calls.list
 assert $pake hello
@@ -46,10 +47,17 @@ assert __build/__default/hello
 rm __build/calls.list
 assert touch hello.pake
 assert $pake hello
-assert grep -e -c.*main.cpp __build/calls.list > /dev/null
+assert_fail test -f __build/calls.list
+
+big_echo "changing flags of one target rebuilds only its objects"
+cp hello.pake hello.pake.orig
+sed -i "s/sources(foo.cpp)/sources(foo.cpp) compiler_flags(-DFOO)/" hello.pake
+assert $pake hello
+assert_fail grep -e -c.*main.cpp __build/calls.list > /dev/null
 assert grep -e -c.*foo __build/calls.list > /dev/null
 assert grep -e -o.*hello __build/calls.list > /dev/null
 assert __build/__default/hello
+mv hello.pake.orig hello.pake
 
 rm -rf __build
 
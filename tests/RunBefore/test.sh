@@ -25,4 +25,7 @@ rm -rf __build
     assert $pake Test3
     assert test -f __build/__default/Test3
 
+    big_echo "processes left in the background don't hold the build"
+    assert timeout 10 $pake Background
+
 rm -rf __build
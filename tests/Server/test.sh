@@ -0,0 +1,110 @@
+. ../common.sh
+
+function wait_for()
+{
+    for i in `seq 100`; do
+        if "$@" > /dev/null 2>&1; then
+            return 0
+        fi
+        sleep 0.1
+    done
+    return 1
+}
+
+function interrupt_after()
+{
+    python - "$@" <<'EOF'
+import sys, time, signal, subprocess
+client = subprocess.Popen(sys.argv[2:])
+time.sleep(float(sys.argv[1]))
+client.send_signal(signal.SIGINT)
+sys.exit(client.wait())
+EOF
+}
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int main() {}" > hello.cpp
+    echo 'target application hello sources(hello.cpp)' > hello.pake
+
+    $pake --server > server.log 2>&1 &
+    server_pid=$!
+    assert wait_for test -S __build/pake.socket
+
+    big_echo "modules changed before the first request are parsed again"
+    echo 'target application hello2 sources(hello.cpp)' >> hello.pake
+    assert $pake hello2
+    assert __build/__default/hello2
+
+    assert $pake hello
+    assert __build/__default/hello
+    assert_fail $pake unknown
+
+    big_echo "server parses modules again when they change"
+    echo 'target application hello_again sources(hello.cpp)' > again.pake
+    assert $pake hello_again
+    assert __build/__default/hello_again
+
+    rm again.pake
+    assert_fail $pake hello_again
+
+    big_echo "server evaluates variables again when modules change"
+    echo "int main() { return 0; }" > a.cpp
+    echo "int main() { return 2; }" > b.cpp
+    echo 'set $src a.cpp' > sources.pake
+    echo 'target application picked sources($sources.src)' > picked.pake
+    assert $pake picked
+    assert __build/__default/picked
+    echo 'set $src b.cpp' > sources.pake
+    assert $pake picked
+    assert_fail __build/__default/picked
+
+    big_echo "server evaluates variables again when configuration changes"
+    echo 'configuration other' > other.pake
+    echo 'target phony where run_before("echo ${__build} > where.txt")' > where.pake
+    assert $pake where
+    assert grep -q __default where.txt
+    assert $pake -c other where
+    assert grep -q other where.txt
+
+    big_echo "commands see environment of the client"
+    echo 'echo "$FROM_CLIENT" > from_client.txt' > from_client.sh
+    echo 'target phony from_client run_before(./from_client.sh)' > from_client.pake
+    chmod +x from_client.sh
+    export FROM_CLIENT=yes
+    assert $pake from_client
+    unset FROM_CLIENT
+    assert grep -q yes from_client.txt
+
+    big_echo "interrupted client interrupts the build"
+    echo 'target phony slow run_before("sleep 30")' > slow.pake
+    assert_fail interrupt_after 2 $pake slow
+    assert timeout 10 $pake hello
+    assert kill -0 $server_pid
+    rm slow.pake
+
+    big_echo "failed build doesn't affect the next one"
+    echo "syntax error" > hello.cpp
+    assert_fail $pake hello
+    echo "int main() { return 1; }" > hello.cpp
+    assert $pake hello
+    assert_fail __build/__default/hello
+
+    big_echo "watching is never forwarded to the server, even with combined flags"
+    $pake -aw > watch.log 2>&1 &
+    watch_pid=$!
+    assert wait_for grep -q watching watch.log
+    assert timeout 30 $pake hello
+    kill $watch_pid
+
+    big_echo "server removes its socket when it's stopped"
+    kill $server_pid
+    assert wait_for test ! -e __build/pake.socket
+    assert $pake hello
+
+popd > /dev/null
+
+rm -rf __build
@@ -0,0 +1,41 @@
+. ../common.sh
+
+function is_chrome_trace()
+{
+    python -c "import json; json.load(open('$1'))['traceEvents']"
+}
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int main() {}" > main.cpp
+    echo "int f() { return 1; }" > library.cpp
+    echo 'target static_library library sources(library.cpp)' > library.pake
+    echo 'target application traced sources(main.cpp) link_with(library) depends_on(library)' > traced.pake
+
+    $pake -j2 traced --trace trace.json > output.log 2>&1
+    assert test -f __build/__default/traced
+
+    big_echo "trace is a valid chrome trace with every phase"
+    assert is_chrome_trace trace.json
+    assert grep -q '"cat":."discovery"' trace.json
+    assert grep -q '"cat":."parsing"' trace.json
+    assert grep -q '"cat":."compile"' trace.json
+    assert grep -q '"cat":."link"' trace.json
+
+    big_echo "summary shows critical path and slowest units"
+    assert grep -q "critical.path" output.log
+    assert grep -q "slowest.translation.units" output.log
+    assert grep -q "library.cpp" output.log
+
+    big_echo "trace is written even if the build fails"
+    echo "syntax error" > main.cpp
+    rm trace.json
+    assert_fail $pake traced --trace trace.json
+    assert test -f trace.json
+
+popd > /dev/null
+
+rm -rf __build
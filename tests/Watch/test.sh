@@ -0,0 +1,82 @@
+. ../common.sh
+
+function wait_for()
+{
+    for i in `seq 100`; do
+        if "$@" > /dev/null 2>&1; then
+            return 0
+        fi
+        sleep 0.1
+    done
+    return 1
+}
+
+function compiled_times()
+{
+    test `grep -c "c++ $1" watch.log` -eq $2
+}
+
+function watching_times()
+{
+    test `grep -c "watching" watch.log` -eq $1
+}
+
+rm -rf __build
+mkdir -p __build/project
+
+pushd __build/project > /dev/null
+
+    echo "int main() { return 1; }" > hello.cpp
+    echo "int main() { return 0; }" > other.cpp
+    echo 'target application hello sources(hello.cpp)' > hello.pake
+    echo 'target application other sources(other.cpp)' > other.pake
+
+    $pake --watch hello other > watch.log 2>&1 &
+    watch_pid=$!
+
+    assert wait_for grep -q watching watch.log
+    assert_fail __build/__default/hello
+
+    big_echo "changed source is built again"
+    echo "int main() { return 0; }" > hello.cpp
+    assert wait_for __build/__default/hello
+    assert compiled_times other.cpp 1
+
+    big_echo "pake starts over when module changes"
+    echo 'target application hello sources(hello.cpp) compiler_flags(-DHELLO)' > hello.pake
+    assert wait_for grep -q restarting watch.log
+    assert wait_for compiled_times hello.cpp 3
+
+    big_echo "source is built again after it failed to compile"
+    assert wait_for watching_times 3
+    echo "syntax error" > hello.cpp
+    assert wait_for grep -q "failed.building.hello" watch.log
+    rm __build/__default/hello
+    echo "int main() { return 0; }" > hello.cpp
+    assert wait_for __build/__default/hello
+    assert compiled_times hello.cpp 5
+
+    kill $watch_pid
+
+    big_echo "directory spelled in many ways is watched under all of them"
+    mkdir real
+    ln -s real linked
+    echo "int a() { return 0; }" > real/a.cpp
+    echo "int main() { return 0; }" > real/b.cpp
+    echo 'target application spelled sources(linked/a.cpp real/b.cpp)' > spelled.pake
+
+    $pake --watch spelled > watch.log 2>&1 &
+    watch_pid=$!
+
+    assert wait_for watching_times 1
+    echo "int a() { return 1; }" > real/a.cpp
+    assert wait_for compiled_times linked/a.cpp 2
+    assert wait_for watching_times 2
+    echo "int main() { return 1; }" > real/b.cpp
+    assert wait_for compiled_times real/b.cpp 2
+
+    kill $watch_pid
+
+popd > /dev/null
+
+rm -rf __build